@@ -10,11 +10,11 @@ from datetime import datetime
 def analyze_student_data():
     """Analyze student data structure and sorting"""
     try:
-        # Fetch student data
-        response = requests.get("http://localhost:8000/students", timeout=10)
+        # Fetch student data (NDJSON stream, one student per line)
+        response = requests.get("http://localhost:8000/students/export", timeout=10, stream=True)
         
         if response.status_code == 200:
-            students = response.json()
+            students = [json.loads(line) for line in response.iter_lines() if line]
             print(f"Total students: {len(students)}")
             
             # Display first few students with their IDs and creation info
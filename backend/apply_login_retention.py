@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+apply_login_retention.py
+
+Applies the login retention policy once: every UTC day of raw logins older
+than --days is folded into login_rollups, archived to a gzipped NDJSON file
+(MongoDB extended JSON, restorable with mongoimport) and then deleted in
+small batches. Progress is recorded per day in login_retention, so an
+interrupted run can simply be started again.
+
+The server runs the same job in the background when LOGIN_RETENTION_DAYS
+is set; use this script for a one-off cleanup or to try a policy first.
+
+Run from the backend directory:
+    python apply_login_retention.py --days 180 [--archive-dir login_archive] [--batch-size 1000] [--pause 0.5]
+"""
+
+import argparse
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from main import (
+    MONGO_URI, DB_NAME, LOGIN_ARCHIVE_DIR, LOGIN_RETENTION_DAYS,
+    LOGIN_RETENTION_BATCH_SIZE, LOGIN_RETENTION_PAUSE_SECONDS, apply_login_retention,
+)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Archive and delete raw logins older than the retention window")
+    p.add_argument("--days", type=int, default=LOGIN_RETENTION_DAYS or None, required=not LOGIN_RETENTION_DAYS,
+                   help="Keep raw logins for this many days (default: LOGIN_RETENTION_DAYS)")
+    p.add_argument("--archive-dir", type=str, default=LOGIN_ARCHIVE_DIR, help=f"Archive directory (default: {LOGIN_ARCHIVE_DIR})")
+    p.add_argument("--batch-size", type=int, default=LOGIN_RETENTION_BATCH_SIZE, help="Logins deleted per batch")
+    p.add_argument("--pause", type=float, default=LOGIN_RETENTION_PAUSE_SECONDS, help="Seconds to wait between delete batches")
+    return p.parse_args()
+
+
+async def main():
+    args = parse_args()
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        deleted = await apply_login_retention(
+            client[DB_NAME], args.days, archive_dir=args.archive_dir,
+            batch_size=args.batch_size, pause_seconds=args.pause
+        )
+        print(f"✅ Removed {deleted} raw logins older than {args.days} days")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
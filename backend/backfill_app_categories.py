@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+backfill_app_categories.py
+
+Sets the per-category minute totals (categoryMinutes) on PhoneUsage
+documents that were written before the app-category registry existed, or
+under an older APP_CATEGORY_VERSION. Run it after editing the registry in
+main.py and bumping the version. The server also runs the same backfill in
+the background when it starts. Safe to re-run: documents that are already
+up to date are not touched.
+
+Run from the backend directory:
+    python backfill_app_categories.py [--batch-size 500]
+"""
+
+import argparse
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from main import MONGO_URI, DB_NAME, APP_CATEGORY_VERSION, backfill_app_categories
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Backfill PhoneUsage.categoryMinutes")
+    p.add_argument("--batch-size", type=int, default=500, help="Documents per bulk update (default: 500)")
+    return p.parse_args()
+
+
+async def main():
+    args = parse_args()
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        updated = await backfill_app_categories(client[DB_NAME], batch_size=args.batch_size)
+        print(f"✅ Categorized {updated} PhoneUsage documents (registry v{APP_CATEGORY_VERSION})")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+backfill_email_keys.py
+
+Sets the EmailNormalized lookup key on existing Students documents so the
+OTP / password-reset endpoints can find them with a single index probe.
+The server runs the same backfill in the background on startup; use this
+to re-run it by hand. Safe to re-run: only students without the key are
+touched.
+
+Run from the backend directory:
+    python backfill_email_keys.py [--batch-size 500]
+"""
+
+import argparse
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from main import MONGO_URI, DB_NAME, backfill_email_keys
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Backfill Students.EmailNormalized")
+    p.add_argument("--batch-size", type=int, default=500, help="Documents per bulk update (default: 500)")
+    return p.parse_args()
+
+
+async def main():
+    args = parse_args()
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        updated = await backfill_email_keys(client[DB_NAME], batch_size=args.batch_size)
+        print(f"✅ Normalized email key set on {updated} students")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+bench_password_hashing.py
+
+Measures the cost of the scrypt password hash used by /login at several
+work factors, and how many verifications per second the hashing thread
+pool sustains. Use it to pick PASSWORD_SCRYPT_LOG2_N / PASSWORD_HASH_WORKERS
+for the machine the backend runs on (aim for roughly 50-100 ms per hash).
+
+Run from the backend directory (needs the same .env as the server):
+    python bench_password_hashing.py [--log2-n 12 13 14 15] [--workers 4] [--logins 64]
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from main import hash_password_sync, verify_password_sync
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark scrypt password hashing")
+    p.add_argument("--log2-n", type=int, nargs="+", default=[12, 13, 14, 15], help="Work factors to test (N = 2**value)")
+    p.add_argument("--workers", type=int, default=4, help="Hashing pool size (default: 4)")
+    p.add_argument("--logins", type=int, default=64, help="Verifications per throughput run (default: 64)")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    print(f"{'log2 N':>6} | {'hash ms':>8} | {'verify ms':>9} | {'logins/s (' + str(args.workers) + ' workers)':>22}")
+    print("-" * 56)
+    for log2_n in args.log2_n:
+        started = time.perf_counter()
+        stored = hash_password_sync("Benchmark@123", log2_n=log2_n)
+        hash_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        verify_password_sync("Benchmark@123", stored)
+        verify_ms = (time.perf_counter() - started) * 1000
+
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            started = time.perf_counter()
+            list(pool.map(lambda _: verify_password_sync("Benchmark@123", stored), range(args.logins)))
+            throughput = args.logins / (time.perf_counter() - started)
+
+        print(f"{log2_n:>6} | {hash_ms:>8.1f} | {verify_ms:>9.1f} | {throughput:>22.1f}")
+
+
+if __name__ == "__main__":
+    main()
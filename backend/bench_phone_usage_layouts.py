@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+bench_phone_usage_layouts.py
+
+Compares the daily (PhoneUsage) and monthly (PhoneUsageMonthly) storage
+layouts on the same synthetic data: bulk write time, 14-day window reads
+for single students (read_days), the features aggregation for the whole
+cohort, and the resulting document count, data size and index size. It
+also checks that both layouts return identical features.
+
+Everything is written to a scratch database (default: <DB_NAME>_layout_bench)
+that is dropped afterwards unless --keep is given; the real collections
+are never touched. Needs a running MongoDB: collection sizes come from
+$collStats, which mongomock does not provide.
+
+Run from the backend directory (needs the same .env as the server):
+    python bench_phone_usage_layouts.py [--students 1000] [--days 90] [--reads 200] [--keep]
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import time
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from main import (
+    MONGO_URI, DB_NAME, PHONE_USAGE_STORES, RECOMMENDATION_WINDOW_DAYS, REQUIRED_INDEXES,
+    categorize_phone_usage, create_phone_usage_store,
+)
+
+APPS = ["Google Classroom", "Zoom", "Docs", "Khan Academy", "YouTube", "Instagram", "WhatsApp", "Netflix"]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark the daily vs monthly PhoneUsage layouts")
+    p.add_argument("--students", type=int, default=1000, help="Students to generate (default: 1000)")
+    p.add_argument("--days", type=int, default=90, help="Days of usage per student (default: 90)")
+    p.add_argument("--reads", type=int, default=200, help="Single-student window reads to time (default: 200)")
+    p.add_argument("--batch-size", type=int, default=500, help="Days per write_days call (default: 500)")
+    p.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+    p.add_argument("--db", default=f"{DB_NAME}_layout_bench", help="Scratch database (default: %(default)s)")
+    p.add_argument("--keep", action="store_true", help="Keep the scratch database afterwards")
+    return p.parse_args()
+
+
+def synthetic_days(students, days, rng):
+    first_day = datetime(2025, 1, 1)
+    records = []
+    for i in range(students):
+        for d in range(days):
+            apps = [{"appName": app, "durationMinutes": rng.randint(5, 180)} for app in rng.sample(APPS, 4)]
+            records.append((f"STU{i:06d}", first_day + timedelta(days=d), {
+                "screenTime": sum(a["durationMinutes"] for a in apps),
+                "nightUsage": rng.randint(0, 240),
+                "appsUsed": apps,
+                **categorize_phone_usage(apps),
+            }))
+    return records
+
+
+def same_features(a, b):
+    """Equal up to float rounding: the layouts feed $avg the same days in a different order."""
+    return all(
+        a[w].keys() == b[w].keys()
+        and all(math.isclose(x, y, rel_tol=1e-9) for sid in a[w] for x, y in zip(a[w][sid], b[w][sid]))
+        for w in a
+    )
+
+
+async def collection_stats(collection):
+    stats = await collection.aggregate([{"$collStats": {"storageStats": {}}}]).next()
+    return stats["storageStats"]
+
+
+async def bench_layout(db, layout, records, window_starts, reads, batch_size):
+    store = create_phone_usage_store(db, layout)
+    await store.collection.drop()
+    await store.collection.create_indexes(REQUIRED_INDEXES[store.collection.name])
+
+    started = time.perf_counter()
+    for i in range(0, len(records), batch_size):
+        await store.write_days(records[i:i + batch_size])
+    write_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for student_id, window_start in reads:
+        await store.read_days(student_id, window_start, window_start + timedelta(days=RECOMMENDATION_WINDOW_DAYS))
+    read_ms = (time.perf_counter() - started) * 1000 / max(len(reads), 1)
+
+    features = {}
+    started = time.perf_counter()
+    for window_start in window_starts:
+        features[window_start] = await store.features(window_start)
+    features_ms = (time.perf_counter() - started) * 1000 / len(window_starts)
+
+    stats = await collection_stats(store.collection)
+    return {
+        "write_s": write_s, "read_ms": read_ms, "features_ms": features_ms, "features": features,
+        "count": stats["count"], "size_mb": stats["size"] / 2**20, "index_mb": stats["totalIndexSize"] / 2**20,
+    }
+
+
+async def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    records = synthetic_days(args.students, args.days, rng)
+    last_day = max(day for _, day, _ in records)
+    # Windows ending on the last generated day, and one straddling a month boundary
+    window_starts = [last_day - timedelta(days=RECOMMENDATION_WINDOW_DAYS - 1), datetime(2025, 1, 25)]
+    reads = [(f"STU{rng.randrange(args.students):06d}", rng.choice(window_starts)) for _ in range(args.reads)]
+    print(f"{args.students} students x {args.days} days = {len(records)} PhoneUsage days, database '{args.db}'")
+
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        db = client[args.db]
+        results = {}
+        for layout in PHONE_USAGE_STORES:
+            results[layout] = await bench_layout(db, layout, records, window_starts, reads, args.batch_size)
+
+        print(f"{'layout':>8} | {'docs':>8} | {'data MB':>7} | {'index MB':>8} | {'write s':>7} | {'read ms':>7} | {'features ms':>11}")
+        print("-" * 76)
+        for layout, r in results.items():
+            print(f"{layout:>8} | {r['count']:>8} | {r['size_mb']:>7.1f} | {r['index_mb']:>8.2f} | "
+                  f"{r['write_s']:>7.2f} | {r['read_ms']:>7.2f} | {r['features_ms']:>11.1f}")
+        print(f"identical features: {all(same_features(r['features'], results['daily']['features']) for r in results.values())}")
+    finally:
+        if not args.keep:
+            await client.drop_database(args.db)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+bench_recommendation_engine.py
+
+Compares the per-student recommendation path (build_recommendation) with
+the vectorized cohort engine (build_recommendations_vectorized) on a
+synthetic cohort, and checks that both produce identical documents. The
+"score ms" column times only the rule masks (score_cohort_usage) on
+already-loaded arrays; the rest of the vectorized time is spent rendering
+documents. The cohort includes values exactly at the rule thresholds and
+marks stored as Decimal, which the engine hands back to the scalar
+cascade. No database is needed: the cohort is generated in memory with a
+fixed seed, and its PhoneUsage features come from summarize_phone_usage, the
+in-memory equivalent of the features aggregation.
+
+Run from the backend directory (needs the same .env as the server):
+    python bench_recommendation_engine.py [--students 200 2000 20000] [--days 14] [--repeat 5]
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from bson import ObjectId
+
+from main import (
+    RECOMMENDATION_RULES, build_recommendation, build_recommendations_vectorized, load_cohort_usage,
+    recommendation_metrics, score_cohort_usage, summarize_phone_usage,
+)
+
+APPS = ["Google Classroom", "Zoom", "Docs", "Khan Academy", "YouTube", "Instagram", "WhatsApp", "Netflix"]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark scalar vs vectorized recommendation scoring")
+    p.add_argument("--students", type=int, nargs="+", default=[200, 2000, 20000], help="Cohort sizes to test")
+    p.add_argument("--days", type=int, default=14, help="PhoneUsage days per student (default: 14)")
+    p.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+    p.add_argument("--repeat", type=int, default=5, help="Timed runs per measurement; the best is reported (default: 5)")
+    return p.parse_args()
+
+
+def synthetic_cohort(size, days, rng):
+    window_start = datetime(2025, 1, 1)
+    mark_thresholds = [rule["when"][2] for rule in RECOMMENDATION_RULES if rule["when"] and rule["when"][0] == "current_mark"]
+    cohort = []
+    for i in range(size):
+        academic = {
+            "_id": ObjectId(),
+            "overallMark": rng.choice([
+                rng.randint(30, 100), round(rng.uniform(30, 100), 1), rng.choice(mark_thresholds),
+                Decimal(str(round(rng.uniform(30, 100), 1))),
+            ]),
+            "studyHours": rng.choice(["", "1.5", str(rng.randint(0, 6))]),
+            "focusLevel": rng.choice(["", str(rng.randint(1, 10))]),
+        }
+        phone_days = []
+        for d in range(rng.randint(0, days)):
+            apps = [{"appName": app, "durationMinutes": rng.randint(5, 180)} for app in rng.sample(APPS, 4)]
+            phone_days.append({
+                "date": window_start + timedelta(days=d),
+                "screenTime": rng.choice([0, sum(a["durationMinutes"] for a in apps)]),
+                "nightUsage": rng.randint(0, 240),
+                "appsUsed": apps,
+            })
+        fingerprint = {"academicId": academic["_id"], "phoneUsageWindowStart": window_start, "phoneUsageVersion": 0}
+        cohort.append((f"STU{i:06d}", academic, summarize_phone_usage(phone_days), fingerprint))
+    return cohort
+
+
+def best_ms(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def without_timestamp(doc):
+    return {k: v for k, v in doc.items() if k != "generatedAt"}
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    print(f"{'students':>8} | {'scalar ms':>9} | {'vector ms':>9} | {'speedup':>7} | {'score ms':>8} | identical")
+    print("-" * 65)
+    for size in args.students:
+        cohort = synthetic_cohort(size, args.days, rng)
+
+        scalar_ms, scalar = best_ms(lambda: [build_recommendation(*student) for student in cohort], args.repeat)
+        vector_ms, vector = best_ms(lambda: build_recommendations_vectorized(cohort), args.repeat)
+        metrics = load_cohort_usage([recommendation_metrics(academic, usage) for _, academic, usage, _ in cohort])
+        score_ms, _ = best_ms(lambda: score_cohort_usage(metrics), args.repeat)
+
+        identical = all(
+            without_timestamp(a) == without_timestamp(b) and repr(without_timestamp(a)) == repr(without_timestamp(b))
+            for a, b in zip(scalar, vector)
+        ) and len(scalar) == len(vector)
+        print(f"{size:>8} | {scalar_ms:>9.1f} | {vector_ms:>9.1f} | {scalar_ms / vector_ms:>6.1f}x | {score_ms:>8.1f} | {identical}")
+
+
+if __name__ == "__main__":
+    main()
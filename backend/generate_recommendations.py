@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+generate_recommendations.py
+
+Recomputes recommendations for every student in batches, writing each batch
+with a single bulk upsert. Progress is saved in recommendation_jobs, so if
+the run is interrupted, running the script again continues where it
+stopped; pass --restart to start over from the first student. The same job
+can be started from the server with POST /recommendations/generate_all.
+
+Run from the backend directory:
+    python generate_recommendations.py [--batch-size 200] [--concurrency 4] [--restart]
+"""
+
+import argparse
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from main import (
+    MONGO_URI, DB_NAME, RECOMMENDATION_JOB_BATCH_SIZE, RECOMMENDATION_JOB_CONCURRENCY,
+    open_recommendation_job, run_recommendation_job,
+)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Recompute recommendations for the whole cohort")
+    p.add_argument("--batch-size", type=int, default=RECOMMENDATION_JOB_BATCH_SIZE, help="Students per bulk write")
+    p.add_argument("--concurrency", type=int, default=RECOMMENDATION_JOB_CONCURRENCY, help="Batches generated at once")
+    p.add_argument("--restart", action="store_true", help="Ignore any unfinished job and start from the first student")
+    return p.parse_args()
+
+
+def report(job):
+    percent = job["processed"] / job["total"] * 100 if job["total"] else 100.0
+    print(f"  {job['processed']}/{job['total']} students ({percent:.1f}%), {job['generated']} recommendations written")
+
+
+async def main():
+    args = parse_args()
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        db = client[DB_NAME]
+        job = await open_recommendation_job(db, restart=args.restart)
+        if job["lastStudentId"]:
+            print(f"Resuming job {job['_id']} after student {job['lastStudentId']}")
+        else:
+            print(f"Starting job {job['_id']} for {job['total']} students")
+        job = await run_recommendation_job(db, job, batch_size=args.batch_size, concurrency=args.concurrency, on_progress=report)
+        print(f"✅ Generated {job['generated']} recommendations")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,21 +1,39 @@
 import os
-from typing import List, Optional, Any
+from typing import Any, Callable, List, Optional
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, status, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, Extra
+from pydantic import BaseModel, Field, Extra, ValidationError
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from bson import ObjectId
 
 import random
+import base64
+import struct
+import time
+import uuid
+import hmac
+import hashlib
+import asyncio
+import gzip
 import smtplib
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from bson import ObjectId, json_util
-import json
-from fastapi.responses import JSONResponse
+from bson import ObjectId, Decimal128, json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+import orjson
+import numpy as np
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 
 # ========================
@@ -42,6 +60,65 @@ SMTP_SERVER = os.getenv("EMAIL_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("EMAIL_PORT", "587"))
 EMAIL_ADDRESS = os.getenv("EMAIL_USER")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASS")
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "true").lower() != "false"
+SMTP_TIMEOUT = float(os.getenv("EMAIL_TIMEOUT", "15"))
+
+# OTP storage backend: "mongo" (TTL-indexed otp_tokens) or "memory" (single-node only)
+OTP_STORE = os.getenv("OTP_STORE", "mongo").lower()
+OTP_TTL = timedelta(minutes=10)          # how long an emailed OTP stays valid
+RESET_TOKEN_TTL = timedelta(minutes=30)  # how long a verified reset token stays valid
+
+# Password hashing (scrypt): work factor N = 2**PASSWORD_SCRYPT_LOG2_N, run on a bounded thread pool
+PASSWORD_SCRYPT_LOG2_N = int(os.getenv("PASSWORD_SCRYPT_LOG2_N", "14"))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+
+# Login audit write-behind buffer: flush on size or age, with configurable write concern
+LOGIN_AUDIT_BATCH_SIZE = int(os.getenv("LOGIN_AUDIT_BATCH_SIZE", "100"))
+LOGIN_AUDIT_FLUSH_SECONDS = float(os.getenv("LOGIN_AUDIT_FLUSH_SECONDS", "2"))
+LOGIN_AUDIT_MAX_PENDING = int(os.getenv("LOGIN_AUDIT_MAX_PENDING", "10000"))
+LOGIN_AUDIT_W = os.getenv("LOGIN_AUDIT_W", "1")  # 0, 1, 2, ... or "majority"
+
+# Number of recent login events /monitor can serve from memory
+RECENT_LOGINS_CAPACITY = int(os.getenv("RECENT_LOGINS_CAPACITY", "500"))
+
+# /monitor/stream: per-subscriber queue size and idle heartbeat interval
+LOGIN_STREAM_QUEUE_SIZE = int(os.getenv("LOGIN_STREAM_QUEUE_SIZE", "100"))
+LOGIN_STREAM_HEARTBEAT_SECONDS = float(os.getenv("LOGIN_STREAM_HEARTBEAT_SECONDS", "15"))
+
+# Login retention: raw logins older than LOGIN_RETENTION_DAYS are folded into the rollups,
+# archived as gzipped NDJSON under LOGIN_ARCHIVE_DIR and deleted in throttled batches (0 = keep forever)
+LOGIN_RETENTION_DAYS = int(os.getenv("LOGIN_RETENTION_DAYS", "0"))
+LOGIN_ARCHIVE_DIR = os.getenv("LOGIN_ARCHIVE_DIR", "login_archive")
+LOGIN_RETENTION_BATCH_SIZE = int(os.getenv("LOGIN_RETENTION_BATCH_SIZE", "1000"))
+LOGIN_RETENTION_PAUSE_SECONDS = float(os.getenv("LOGIN_RETENTION_PAUSE_SECONDS", "0.5"))
+LOGIN_RETENTION_INTERVAL_HOURS = float(os.getenv("LOGIN_RETENTION_INTERVAL_HOURS", "24"))
+
+# Cohort recommendation job: students per bulk_write and batches generated concurrently
+RECOMMENDATION_JOB_BATCH_SIZE = int(os.getenv("RECOMMENDATION_JOB_BATCH_SIZE", "200"))
+RECOMMENDATION_JOB_CONCURRENCY = int(os.getenv("RECOMMENDATION_JOB_CONCURRENCY", "4"))
+
+# App sessions: upload size, longest accepted session, night window (local hours) and how
+# often / how many new sessions the compaction stage folds into PhoneUsage per pass
+APP_SESSION_BATCH_MAX = int(os.getenv("APP_SESSION_BATCH_MAX", "5000"))
+APP_SESSION_MAX_HOURS = int(os.getenv("APP_SESSION_MAX_HOURS", "24"))
+NIGHT_START_HOUR = int(os.getenv("NIGHT_START_HOUR", "22"))
+NIGHT_END_HOUR = int(os.getenv("NIGHT_END_HOUR", "6"))
+APP_SESSION_COMPACT_SECONDS = float(os.getenv("APP_SESSION_COMPACT_SECONDS", "15"))
+APP_SESSION_COMPACT_BATCH = int(os.getenv("APP_SESSION_COMPACT_BATCH", "5000"))
+
+# PhoneUsage storage layout: "daily" (PhoneUsage, one document per student-day) or
+# "monthly" (PhoneUsageMonthly, one bucket per student-month); see PhoneUsageStore
+PHONE_USAGE_LAYOUT = os.getenv("PHONE_USAGE_LAYOUT", "daily").lower()
+
+# Rolling usage windows: windows aged per bulk write by the nightly sweep
+USAGE_WINDOW_SWEEP_BATCH = int(os.getenv("USAGE_WINDOW_SWEEP_BATCH", "1000"))
+
+# Email delivery queue: worker count (= pooled SMTP sessions) and retry policy
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "4"))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "2"))
 
 # Print environment variables for debugging (remove in production)
 # print(f"DEBUG: After loading, EMAIL_USER={os.getenv('EMAIL_USER')}")
@@ -86,14 +163,127 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# ========================
+# Index definitions
+# ========================
+# Every query shape used by the routes below must be backed by one of these
+# indexes. They are created (if missing) and verified on startup, and /ready
+# reports 503 until all of them exist.
+REQUIRED_INDEXES = {
+    "Users": [
+        IndexModel([("username", ASCENDING)], name="username_1", unique=True),
+    ],
+    "Students": [
+        IndexModel([("UserID", ASCENDING)], name="UserID_1"),
+        IndexModel([("Admission No", ASCENDING)], name="AdmissionNo_1"),
+        IndexModel([("EmailNormalized", ASCENDING)], name="EmailNormalized_1"),
+    ],
+    "academics": [
+        IndexModel([("studentId", ASCENDING), ("createdAt", DESCENDING)], name="studentId_1_createdAt_-1"),
+    ],
+    "PhoneUsage": [
+        IndexModel([("studentId", ASCENDING), ("date", ASCENDING)], name="studentId_1_date_1", unique=True),
+        IndexModel([("categoryVersion", ASCENDING)], name="categoryVersion_1"),
+    ],
+    "PhoneUsageMonthly": [
+        IndexModel([("studentId", ASCENDING), ("month", ASCENDING)], name="studentId_1_month_1", unique=True),
+        IndexModel([("categoryVersion", ASCENDING)], name="categoryVersion_1"),
+    ],
+    "logins": [
+        IndexModel([("time", DESCENDING), ("_id", DESCENDING)], name="time_-1__id_-1"),
+    ],
+    "recommendations": [
+        IndexModel([("studentId", ASCENDING)], name="studentId_1"),
+    ],
+    "app_sessions": [
+        IndexModel([("studentId", ASCENDING), ("start", ASCENDING), ("appName", ASCENDING)],
+                   name="studentId_1_start_1_appName_1", unique=True),
+        # Only sessions still waiting for compaction are indexed
+        IndexModel([("compacted", ASCENDING), ("_id", ASCENDING)], name="compacted_1__id_1",
+                   partialFilterExpression={"compacted": False}),
+    ],
+    "phone_usage_versions": [
+        IndexModel([("studentId", ASCENDING)], name="studentId_1", unique=True),
+    ],
+    "phone_usage_windows": [
+        IndexModel([("studentId", ASCENDING)], name="studentId_1", unique=True),
+        IndexModel([("windowStart", ASCENDING)], name="windowStart_1"),
+    ],
+    "recommendation_jobs": [
+        IndexModel([("status", ASCENDING), ("startedAt", DESCENDING)], name="status_1_startedAt_-1"),
+    ],
+    "login_rollups": [
+        IndexModel([("hour", ASCENDING), ("role", ASCENDING)], name="hour_1_role_1", unique=True),
+        IndexModel([("day", ASCENDING)], name="day_1"),
+    ],
+    "login_retention": [
+        IndexModel([("day", ASCENDING)], name="day_1", unique=True),
+    ],
+    "otp_tokens": [
+        IndexModel([("email", ASCENDING)], name="email_1", unique=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+def _index_key(spec, ttl=None, unique=False) -> tuple:
+    """Normalize an index key spec (plus TTL and uniqueness) so declared and existing indexes compare equal."""
+    return tuple((field, int(direction)) for field, direction in spec), ttl, bool(unique)
+
+async def ensure_indexes(db) -> List[str]:
+    """Create the declared indexes, then verify they exist.
+
+    An existing index that is declared unique but was built without the
+    option is rebuilt, after the collection's entry in UNIQUE_INDEX_DEDUPERS
+    has removed the duplicate keys. Returns a list of "<collection>.<index>"
+    entries that are still missing after the build; an empty list means
+    every required index is in place.
+    """
+    for coll_name, models in REQUIRED_INDEXES.items():
+        existing = await db[coll_name].index_information()
+        for model in models:
+            index_name = model.document["name"]
+            started = time.perf_counter()
+            try:
+                current = existing.get(index_name)
+                if current is not None and model.document.get("unique") and not current.get("unique"):
+                    dedupe = UNIQUE_INDEX_DEDUPERS.get(coll_name)
+                    if dedupe is None:
+                        print(f"❌ {coll_name}.{index_name} exists without the unique option and no deduper is "
+                              f"registered for {coll_name} in UNIQUE_INDEX_DEDUPERS; remove the duplicates and "
+                              f"drop the index by hand")
+                        continue
+                    removed = await dedupe(db)
+                    print(f"✅ Resolved {removed} duplicate {coll_name} documents before making {index_name} unique")
+                    await db[coll_name].drop_index(index_name)
+                await db[coll_name].create_indexes([model])
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                print(f"✅ Index {coll_name}.{index_name} ready in {elapsed_ms:.1f} ms")
+            except Exception as e:
+                print(f"❌ Failed to build index {coll_name}.{index_name}: {e}")
+
+    missing = []
+    for coll_name, models in REQUIRED_INDEXES.items():
+        existing = await db[coll_name].index_information()
+        existing_keys = {
+            _index_key(info["key"], info.get("expireAfterSeconds"), info.get("unique")) for info in existing.values()
+        }
+        for model in models:
+            declared = _index_key(
+                model.document["key"].items(), model.document.get("expireAfterSeconds"), model.document.get("unique")
+            )
+            if declared not in existing_keys:
+                missing.append(f"{coll_name}.{model.document['name']}")
+    return missing
+
 # ========================
 # MongoDB Atlas connection (using motor for async)
 # ========================
 @app.on_event("startup")
 async def startup_db_client():
-    """Connects to MongoDB Atlas on app startup."""
+    """Connects to MongoDB Atlas on app startup and bootstraps the index set."""
     try:
         app.mongodb_client = AsyncIOMotorClient(MONGO_URI)
         app.mongodb = app.mongodb_client[DB_NAME]
@@ -101,13 +291,127 @@ async def startup_db_client():
     except Exception as e:
         raise RuntimeError(f"❌ MongoDB connection error: {e}")
 
+    # Build the indexes before anything writes: the unique ones cannot be built
+    # once concurrent upserts have inserted duplicates
+    app.missing_indexes = await ensure_indexes(app.mongodb)
+    if app.missing_indexes:
+        print(f"❌ Required indexes missing, not ready: {', '.join(app.missing_indexes)}")
+    else:
+        print("✅ All required indexes verified")
+
+    app.otp_store = create_otp_store(app.mongodb)
+
+    app.email_queue = EmailDeliveryQueue(EMAIL_WORKERS, EMAIL_MAX_ATTEMPTS, EMAIL_RETRY_BASE_SECONDS)
+    app.email_queue.start()
+
+    # Rollups start out empty on the first deploy: count today's logins before the audit
+    # buffer starts $inc'ing the current hour, and backfill older days in the background
+    app.rollup_backfill = None
+    if not await app.mongodb["login_rollups"].find_one({}, {"_id": 1}) and \
+            await app.mongodb["logins"].find_one({}, {"_id": 1}):
+        current_hour = rollup_hour(datetime.utcnow())
+        await rebuild_login_rollups(app.mongodb, since=current_hour, until=current_hour + timedelta(hours=1))
+        app.rollup_backfill = asyncio.create_task(
+            run_login_rollup_backfill(app.mongodb, until=current_hour.replace(hour=0))
+        )
+
+    app.login_audit = LoginEventBuffer(
+        app.mongodb["logins"].with_options(write_concern=parse_write_concern(LOGIN_AUDIT_W)),
+        LOGIN_AUDIT_BATCH_SIZE,
+        LOGIN_AUDIT_FLUSH_SECONDS,
+        LOGIN_AUDIT_MAX_PENDING,
+        rollups=app.mongodb["login_rollups"]
+    )
+    app.login_audit.start()
+
+    app.login_hub = LoginEventHub(LOGIN_STREAM_QUEUE_SIZE)
+    app.recent_logins = RecentLoginsRing(RECENT_LOGINS_CAPACITY)
+    try:
+        await seed_recent_logins(app.mongodb, app.recent_logins)
+    except Exception as e:
+        # /monitor keeps working from Mongo until the ring is seeded
+        print(f"❌ Could not seed recent logins: {e}")
+
+    app.recommendation_job = None
+    app.email_key_backfill = asyncio.create_task(run_email_key_backfill(app.mongodb))
+    app.category_backfill = asyncio.create_task(run_app_category_backfill(app.mongodb))
+    app.session_compaction = asyncio.create_task(run_app_session_compaction(app.mongodb))
+    app.window_sweep = asyncio.create_task(run_usage_window_sweep(app.mongodb))
+    app.retention_task = None
+    if LOGIN_RETENTION_DAYS > 0:
+        app.retention_task = asyncio.create_task(run_login_retention_periodically(app.mongodb))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    """Closes the MongoDB connection on app shutdown."""
+    """Flushes buffered login events, drains the email queue and closes the MongoDB connection on app shutdown."""
+    for task in (getattr(app, 'retention_task', None), getattr(app, 'recommendation_job', None),
+                 getattr(app, 'category_backfill', None), getattr(app, 'session_compaction', None),
+                 getattr(app, 'window_sweep', None), getattr(app, 'rollup_backfill', None),
+                 getattr(app, 'email_key_backfill', None)):
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    if hasattr(app, 'login_audit'):
+        await app.login_audit.stop()
+    if hasattr(app, 'email_queue'):
+        await app.email_queue.stop()
+    password_pool.shutdown(wait=False)
     if hasattr(app, 'mongodb_client'):
         app.mongodb_client.close()
         print("❌ Disconnected from MongoDB Atlas")
 
+@app.get("/ready", response_description="Readiness probe")
+async def readiness():
+    """Report ready only once every required index has been verified."""
+    missing = getattr(app, "missing_indexes", None)
+    if missing is None or missing:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"ready": False, "missingIndexes": missing or []}
+        )
+    return {"ready": True}
+
+# ========================
+# Response encoding
+# ========================
+# All read endpoints return documents through MongoJSONResponse, which encodes
+# ObjectId/datetime directly to bytes with orjson (no json_util round trip and
+# no jsonable_encoder pass). Clients sending "Accept: application/bson" to
+# endpoints that support it get the raw BSON bytes from the driver instead.
+BSON_MEDIA_TYPE = "application/bson"
+RAW_BSON_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+def bson_default(obj: Any) -> Any:
+    """orjson fallback for BSON types it does not encode natively."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, RawBSONDocument):
+        return dict(obj)  # nested documents are decoded lazily, one level at a time
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def encode_json(content: Any) -> bytes:
+    """Encode documents (or anything containing them) straight to JSON bytes."""
+    return orjson.dumps(content, default=bson_default, option=orjson.OPT_NON_STR_KEYS)
+
+class MongoJSONResponse(JSONResponse):
+    """JSONResponse rendered with encode_json."""
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
+
+class RawBSONResponse(Response):
+    """Concatenated RawBSONDocuments, passed through without decoding."""
+    media_type = BSON_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return b"".join(doc.raw for doc in content)
+
+def wants_raw_bson(request: Request) -> bool:
+    """True when the client asked for raw BSON instead of JSON."""
+    return BSON_MEDIA_TYPE in request.headers.get("accept", "")
+
 # ========================
 # Pydantic models
 # ========================
@@ -148,6 +452,25 @@ class AcademicData(BaseModel):
     focusLevel: str
     overallMark: int
 
+# PhoneUsage upload models: one record per student per day
+class AppUsage(BaseModel):
+    appName: str
+    durationMinutes: int = Field(ge=0)
+
+class PhoneUsageRecord(BaseModel):
+    studentId: str
+    date: date
+    screenTime: int = Field(ge=0)
+    nightUsage: int = Field(0, ge=0)
+    appsUsed: List[AppUsage] = []
+
+# A single foreground session of one app, in the device's local wall-clock time
+class AppSession(BaseModel):
+    studentId: str
+    appName: str
+    start: datetime
+    end: datetime
+
 # OTP Models
 class EmailCheckRequest(BaseModel):
     email: str
@@ -169,8 +492,8 @@ class PasswordResetRequest(BaseModel):
 # Email and OTP utility functions
 # ========================
 
-async def send_email_otp(to_email: str, otp: str) -> bool:
-    """Send OTP via email using SMTP"""
+def email_configured() -> bool:
+    """True when SMTP credentials are available for outgoing mail."""
     if not EMAIL_ADDRESS:
         print("❌ EMAIL_ADDRESS is None or empty")
         return False
@@ -179,12 +502,12 @@ async def send_email_otp(to_email: str, otp: str) -> bool:
         print("❌ EMAIL_PASSWORD is None or empty")
         return False
     
-    print(f"✅ Email credentials found. EMAIL_ADDRESS={EMAIL_ADDRESS}")
-    
-    try:
-        # Create message
-        subject = "Password Reset OTP - AI Wellness System"
-        body = f"""
+    return True
+
+def build_otp_message(to_email: str, otp: str) -> MIMEText:
+    """Build the password-reset OTP email."""
+    subject = "Password Reset OTP - AI Wellness System"
+    body = f"""
         Dear User,
         
         Your One-Time Password (OTP) for password reset is: {otp}
@@ -196,23 +519,171 @@ async def send_email_otp(to_email: str, otp: str) -> bool:
         Best regards,
         AI Wellness System Team
         """
-        
-        msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = EMAIL_ADDRESS
-        msg['To'] = to_email
-        
-        # Send email
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
+    
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    msg['From'] = EMAIL_ADDRESS
+    msg['To'] = to_email
+    return msg
+
+def open_smtp_session() -> smtplib.SMTP:
+    """Connect, STARTTLS and log in. Blocking; call from a worker thread."""
+    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    try:
+        if EMAIL_USE_TLS:
             server.starttls()
+        server.ehlo_or_helo_if_needed()
+        # Local stand-ins (e.g. aiosmtpd) may not offer AUTH at all
+        if server.has_extn("auth"):
             server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            server.send_message(msg)
-        
-        print(f"✅ OTP email sent successfully to {to_email}")
-        return True
+    except Exception:
+        server.close()
+        raise
+    return server
+
+def close_smtp_session(server: smtplib.SMTP) -> None:
+    """Politely end an SMTP session, ignoring a connection that is already gone."""
+    try:
+        server.quit()
+    except Exception:
+        server.close()
+
+class EmailDeliveryQueue:
+    """In-process queue of outgoing emails drained by worker tasks.
+
+    Each worker owns one authenticated SMTP session and reuses it for every
+    job it picks up, so the pool size equals the worker count. All smtplib
+    calls run in a thread, so a slow mail server never blocks the event loop.
+    Failed sends are retried with exponential backoff, and the outcome of the
+    most recent jobs is kept for status lookups.
+    """
+
+    def __init__(self, workers: int, max_attempts: int, retry_base_seconds: float, status_limit: int = 1000):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.status_limit = status_limit
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.statuses: "OrderedDict[str, dict]" = OrderedDict()
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        for _ in range(self.workers):
+            self.tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Give queued jobs a chance to go out, then stop the workers."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"❌ Email queue stopped with {self.queue.qsize()} undelivered jobs")
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, msg: MIMEText) -> str:
+        """Queue a message and return its delivery id."""
+        delivery_id = uuid.uuid4().hex
+        self._set_status(delivery_id, "queued", attempts=0)
+        self.queue.put_nowait((delivery_id, msg))
+        return delivery_id
+
+    def status(self, delivery_id: str) -> Optional[dict]:
+        return self.statuses.get(delivery_id)
+
+    def _set_status(self, delivery_id: str, state: str, **fields) -> None:
+        entry = self.statuses.setdefault(delivery_id, {"deliveryId": delivery_id})
+        entry.update(fields, status=state, updatedAt=datetime.utcnow())
+        self.statuses.move_to_end(delivery_id)
+        while len(self.statuses) > self.status_limit:
+            self.statuses.popitem(last=False)
+
+    async def _worker(self) -> None:
+        session = None
+        try:
+            while True:
+                delivery_id, msg = await self.queue.get()
+                try:
+                    session = await self._deliver(delivery_id, msg, session)
+                finally:
+                    self.queue.task_done()
+        finally:
+            if session is not None:
+                await asyncio.to_thread(close_smtp_session, session)
+
+    async def _deliver(self, delivery_id: str, msg: MIMEText, session: Optional[smtplib.SMTP]) -> Optional[smtplib.SMTP]:
+        """Send one message, retrying with backoff. Returns the session to keep for the next job."""
+        for attempt in range(1, self.max_attempts + 1):
+            self._set_status(delivery_id, "sending", attempts=attempt)
+            try:
+                if session is not None:
+                    try:
+                        await asyncio.to_thread(session.send_message, msg)
+                    except smtplib.SMTPServerDisconnected:
+                        # The pooled session went idle and was dropped; reconnect without using up an attempt
+                        session = None
+                if session is None:
+                    session = await asyncio.to_thread(open_smtp_session)
+                    await asyncio.to_thread(session.send_message, msg)
+                self._set_status(delivery_id, "sent", attempts=attempt, error=None)
+                print(f"✅ OTP email sent successfully to {msg['To']}")
+                return session
+            except Exception as e:
+                if session is not None:
+                    await asyncio.to_thread(close_smtp_session, session)
+                    session = None
+                if attempt == self.max_attempts:
+                    self._set_status(delivery_id, "failed", attempts=attempt, error=str(e))
+                    print(f"❌ Failed to send email to {msg['To']} after {attempt} attempts: {str(e)}")
+                    return None
+                self._set_status(delivery_id, "retrying", attempts=attempt, error=str(e))
+                await asyncio.sleep(self.retry_base_seconds * 2 ** (attempt - 1))
+        return session
+
+def queue_email_otp(to_email: str, otp: str) -> Optional[str]:
+    """Queue the OTP email for delivery. Returns the delivery id, or None if email is not configured."""
+    if not email_configured():
+        return None
+    return app.email_queue.submit(build_otp_message(to_email, otp))
+
+def normalize_email(email: str) -> str:
+    """Canonical form of an email address, stored on Students as EmailNormalized."""
+    return email.strip().lower()
+
+async def backfill_email_keys(db, batch_size: int = 500) -> int:
+    """Set EmailNormalized on every student that has an Email but no key yet.
+
+    Runs in batches of ``batch_size`` bulk updates; returns the number of
+    students updated.
+    """
+    students_collection = db["Students"]
+    cursor = students_collection.find(
+        {"Email": {"$type": "string"}, "EmailNormalized": {"$exists": False}},
+        {"Email": 1}
+    ).batch_size(batch_size)
+
+    updated = 0
+    ops = []
+    async for s in cursor:
+        ops.append(UpdateOne({"_id": s["_id"]}, {"$set": {"EmailNormalized": normalize_email(s["Email"])}}))
+        if len(ops) >= batch_size:
+            result = await students_collection.bulk_write(ops, ordered=False)
+            updated += result.modified_count
+            ops = []
+    if ops:
+        result = await students_collection.bulk_write(ops, ordered=False)
+        updated += result.modified_count
+    return updated
+
+async def run_email_key_backfill(db) -> None:
+    """Background task: set the lookup key on students stored before EmailNormalized existed."""
+    try:
+        updated = await backfill_email_keys(db)
+        if updated:
+            print(f"✅ Normalized email key set on {updated} students")
     except Exception as e:
-        print(f"❌ Failed to send email: {str(e)}")
-        return False
+        print(f"❌ Email key backfill failed: {e}")
 
 def generate_otp() -> str:
     """Generate a 6-digit OTP"""
@@ -222,6 +693,149 @@ def generate_token() -> str:
     """Generate a random token for verification"""
     return f"token_{random.randint(100000, 999999)}_{int(datetime.utcnow().timestamp())}"
 
+# ========================
+# Password hashing
+# ========================
+# Credentials are stored as "scrypt$<log2 N>$<r>$<p>$<salt>$<hash>". scrypt
+# releases the GIL, so hashing runs on a small dedicated thread pool and the
+# event loop keeps serving other requests while a login is being verified.
+# Rows still holding a plaintext password are upgraded on their next login.
+PASSWORD_HASH_PREFIX = "scrypt$"
+
+password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+def hash_password_sync(password: str, log2_n: int = None, r: int = None, p: int = None) -> str:
+    """Hash a password with scrypt. CPU-heavy; run it on password_pool."""
+    log2_n = PASSWORD_SCRYPT_LOG2_N if log2_n is None else log2_n
+    r = PASSWORD_SCRYPT_R if r is None else r
+    p = PASSWORD_SCRYPT_P if p is None else p
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=2 ** log2_n, r=r, p=p,
+                            maxmem=256 * r * 2 ** log2_n, dklen=32)
+    return f"{PASSWORD_HASH_PREFIX}{log2_n}${r}${p}${_b64(salt)}${_b64(digest)}"
+
+def verify_password_sync(password: str, stored: str) -> bool:
+    """Check a password against a stored scrypt hash. CPU-heavy; run it on password_pool."""
+    try:
+        _, log2_n, r, p, salt, digest = stored.split("$")
+        log2_n, r, p = int(log2_n), int(r), int(p)
+        expected = base64.b64decode(digest)
+        actual = hashlib.scrypt(password.encode("utf-8"), salt=base64.b64decode(salt), n=2 ** log2_n, r=r, p=p,
+                                maxmem=256 * r * 2 ** log2_n, dklen=len(expected))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(actual, expected)
+
+def is_password_hash(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(PASSWORD_HASH_PREFIX)
+
+def needs_rehash(stored: str) -> bool:
+    """True when a stored hash was made with a different work factor than the current one."""
+    return not stored.startswith(f"{PASSWORD_HASH_PREFIX}{PASSWORD_SCRYPT_LOG2_N}${PASSWORD_SCRYPT_R}${PASSWORD_SCRYPT_P}$")
+
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(password_pool, hash_password_sync, password)
+
+async def verify_password(password: str, stored: Any) -> bool:
+    """Verify against a stored hash, or against a legacy plaintext value."""
+    if is_password_hash(stored):
+        return await asyncio.get_running_loop().run_in_executor(password_pool, verify_password_sync, password, stored)
+    if not isinstance(stored, str):
+        return False
+    return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+
+# ========================
+# OTP store
+# ========================
+# OTP records are keyed by normalized email and expire on their own: handlers
+# never compare timestamps, an expired record simply is not returned any more.
+
+class OTPStore(ABC):
+    """Storage for pending OTP / reset-token records, one per email."""
+
+    @abstractmethod
+    async def put(self, email: str, record: dict, ttl: timedelta) -> None:
+        """Replace the record for ``email``; it expires after ``ttl``."""
+
+    @abstractmethod
+    async def get(self, email: str) -> Optional[dict]:
+        """Return the live record for ``email``, or None if absent or expired."""
+
+    @abstractmethod
+    async def update(self, email: str, fields: dict, ttl: timedelta) -> None:
+        """Merge ``fields`` into a live record and restart its expiry at ``ttl``."""
+
+    @abstractmethod
+    async def delete(self, email: str) -> None:
+        """Remove the record for ``email``, if any."""
+
+class MongoOTPStore(OTPStore):
+    """otp_tokens collection; the expires_at TTL index removes dead records."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def put(self, email: str, record: dict, ttl: timedelta) -> None:
+        doc = dict(record, email=email, expires_at=datetime.utcnow() + ttl)
+        await self.collection.replace_one({"email": email}, doc, upsert=True)
+
+    async def get(self, email: str) -> Optional[dict]:
+        # The TTL monitor only runs once a minute, so filter out records it has not reaped yet
+        return await self.collection.find_one({"email": email, "expires_at": {"$gt": datetime.utcnow()}})
+
+    async def update(self, email: str, fields: dict, ttl: timedelta) -> None:
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {"email": email, "expires_at": {"$gt": now}},
+            {"$set": dict(fields, expires_at=now + ttl)}
+        )
+
+    async def delete(self, email: str) -> None:
+        await self.collection.delete_one({"email": email})
+
+class MemoryOTPStore(OTPStore):
+    """Expiring dict for single-node deployments; records are lost on restart."""
+
+    def __init__(self):
+        self.records: dict = {}
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        for email in [e for e, (_, expires) in self.records.items() if expires <= now]:
+            del self.records[email]
+
+    async def put(self, email: str, record: dict, ttl: timedelta) -> None:
+        self._purge()
+        self.records[email] = (dict(record, email=email), time.monotonic() + ttl.total_seconds())
+
+    async def get(self, email: str) -> Optional[dict]:
+        entry = self.records.get(email)
+        if entry is None:
+            return None
+        record, expires = entry
+        if expires <= time.monotonic():
+            del self.records[email]
+            return None
+        return dict(record)
+
+    async def update(self, email: str, fields: dict, ttl: timedelta) -> None:
+        record = await self.get(email)
+        if record is not None:
+            record.update(fields)
+            self.records[email] = (record, time.monotonic() + ttl.total_seconds())
+
+    async def delete(self, email: str) -> None:
+        self.records.pop(email, None)
+
+def create_otp_store(db) -> OTPStore:
+    """Build the OTP store selected by the OTP_STORE setting."""
+    if OTP_STORE == "memory":
+        return MemoryOTPStore()
+    return MongoOTPStore(db["otp_tokens"])
+
 # ========================
 # OTP Routes
 # ========================
@@ -231,10 +845,11 @@ async def check_email_exists(request: EmailCheckRequest):
     """Check if email exists in the database"""
     students_collection = app.mongodb["Students"]
     
-    # Check if email exists in students collection
-    student = await students_collection.find_one({
-        "Email": {"$regex": f"^{request.email}$", "$options": "i"}
-    })
+    # Check if email exists in students collection (single probe on EmailNormalized_1)
+    student = await students_collection.find_one(
+        {"EmailNormalized": normalize_email(request.email)},
+        {"_id": 1}
+    )
     
     return {
         "exists": student is not None,
@@ -245,12 +860,12 @@ async def check_email_exists(request: EmailCheckRequest):
 async def send_otp_to_email(request: OTPRequest):
     """Generate and send OTP to user's email"""
     students_collection = app.mongodb["Students"]
-    otp_collection = app.mongodb["otp_tokens"]
     
     # Verify email exists
-    student = await students_collection.find_one({
-        "Email": {"$regex": f"^{request.email}$", "$options": "i"}
-    })
+    student = await students_collection.find_one(
+        {"EmailNormalized": normalize_email(request.email)},
+        {"_id": 1}
+    )
     
     if not student:
         print(f"DEBUG: Student with email {request.email} not found")
@@ -263,29 +878,23 @@ async def send_otp_to_email(request: OTPRequest):
     token = generate_token()
     print(f"DEBUG: Generated OTP: {otp}, Token: {token}")
     
-    # Store OTP in database with expiration
-    expiry_time = datetime.utcnow() + timedelta(minutes=10)
-    
-    await otp_collection.update_one(
-        {"email": request.email},
+    # Store OTP; the store expires it after OTP_TTL
+    await app.otp_store.put(
+        normalize_email(request.email),
         {
-            "$set": {
-                "email": request.email,
-                "otp": otp,
-                "token": token,
-                "created_at": datetime.utcnow(),
-                "expires_at": expiry_time,
-                "verified": False
-            }
+            "otp": otp,
+            "token": token,
+            "created_at": datetime.utcnow(),
+            "verified": False
         },
-        upsert=True
+        OTP_TTL
     )
     
-    # Send email
-    email_sent = await send_email_otp(request.email, otp)
+    # Queue the email; delivery happens in the background
+    delivery_id = queue_email_otp(request.email, otp)
     
-    if not email_sent:
-        # If real email fails, provide debug info but still return success for development
+    if not delivery_id:
+        # If email is not configured, provide debug info but still return success for development
         print(f"📧 DEBUG: OTP for {request.email} is {otp}")
         return {
             "success": True,
@@ -296,27 +905,31 @@ async def send_otp_to_email(request: OTPRequest):
     
     return {
         "success": True,
-        "message": "OTP sent successfully to your email",
-        "token": token
+        "message": "OTP queued",
+        "token": token,
+        "deliveryId": delivery_id
     }
 
+@app.get("/auth/email-status/{delivery_id}", response_description="Email delivery status")
+async def email_delivery_status(delivery_id: str):
+    """Return the delivery status (queued, sending, retrying, sent, failed) and attempts of a queued email.
+
+    Only those two fields are exposed: the id is handed to whoever requested
+    the OTP, so the recipient and SMTP errors stay server-side.
+    """
+    delivery = app.email_queue.status(delivery_id)
+    if not delivery:
+        raise HTTPException(status_code=404, detail="Unknown delivery id")
+    return MongoJSONResponse({"status": delivery["status"], "attempts": delivery["attempts"]})
+
 @app.post("/auth/verify-otp", response_description="Verify OTP")
 async def verify_otp(request: OTPVerifyRequest):
     """Verify the OTP entered by user"""
-    otp_collection = app.mongodb["otp_tokens"]
-    
-    # Find OTP record
-    otp_record = await otp_collection.find_one({
-        "email": request.email,
-        "token": request.token
-    })
+    # Find OTP record (expired records are never returned)
+    otp_record = await app.otp_store.get(normalize_email(request.email))
     
-    if not otp_record:
-        raise HTTPException(status_code=400, detail="Invalid token or email")
-    
-    # Check if OTP is expired
-    if datetime.utcnow() > otp_record["expires_at"]:
-        raise HTTPException(status_code=400, detail="OTP has expired")
+    if not otp_record or otp_record.get("token") != request.token:
+        raise HTTPException(status_code=400, detail="Invalid or expired token")
     
     # Check if OTP matches
     if otp_record["otp"] != request.otp:
@@ -325,15 +938,15 @@ async def verify_otp(request: OTPVerifyRequest):
     # Mark as verified and generate reset token
     reset_token = generate_token()
     
-    await otp_collection.update_one(
-        {"email": request.email, "token": request.token},
+    # The reset token is valid for RESET_TOKEN_TTL from verification
+    await app.otp_store.update(
+        normalize_email(request.email),
         {
-            "$set": {
-                "verified": True,
-                "reset_token": reset_token,
-                "verified_at": datetime.utcnow()
-            }
-        }
+            "verified": True,
+            "reset_token": reset_token,
+            "verified_at": datetime.utcnow()
+        },
+        RESET_TOKEN_TTL
     )
     
     return {
@@ -345,55 +958,372 @@ async def verify_otp(request: OTPVerifyRequest):
 @app.post("/auth/reset-password", response_description="Reset password")
 async def reset_password(request: PasswordResetRequest):
     """Reset user password after OTP verification"""
-    otp_collection = app.mongodb["otp_tokens"]
     students_collection = app.mongodb["Students"]
     users_collection = app.mongodb["Users"]
     
-    # Verify reset token
-    otp_record = await otp_collection.find_one({
-        "email": request.email,
-        "reset_token": request.token,
-        "verified": True
-    })
-    
-    if not otp_record:
-        raise HTTPException(status_code=400, detail="Invalid reset token")
+    # Verify reset token (expired records are never returned)
+    otp_record = await app.otp_store.get(normalize_email(request.email))
     
-    # Check if token is still valid (within 30 minutes of verification)
-    if datetime.utcnow() > otp_record["verified_at"] + timedelta(minutes=30):
-        raise HTTPException(status_code=400, detail="Reset token has expired")
+    if not otp_record or not otp_record.get("verified") or otp_record.get("reset_token") != request.token:
+        raise HTTPException(status_code=400, detail="Invalid or expired reset token")
     
     # Find student by email
-    student = await students_collection.find_one({
-        "Email": {"$regex": f"^{request.email}$", "$options": "i"}
-    })
+    student = await students_collection.find_one(
+        {"EmailNormalized": normalize_email(request.email)},
+        {"UserID": 1}
+    )
     
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
     # Update password in both collections
     user_id = student.get("UserID")
+    password_hash = await hash_password(request.newPassword)
     
     # Update in Students collection
     await students_collection.update_one(
-        {"Email": {"$regex": f"^{request.email}$", "$options": "i"}},
-        {"$set": {"Password": request.newPassword}}
+        {"_id": student["_id"]},
+        {"$set": {"Password": password_hash}}
     )
     
     # Update in Users collection
     await users_collection.update_one(
         {"username": user_id},
-        {"$set": {"password": request.newPassword}}
+        {"$set": {"password": password_hash}}
     )
     
     # Clean up OTP record
-    await otp_collection.delete_one({"email": request.email})
+    await app.otp_store.delete(normalize_email(request.email))
     
     return {
         "success": True,
         "message": "Password reset successfully"
     }
 
+# ========================
+# Login audit buffer
+# ========================
+
+def parse_write_concern(w: str) -> WriteConcern:
+    """WriteConcern from a setting such as "0", "1" or "majority"."""
+    return WriteConcern(w=int(w) if w.isdigit() else w)
+
+class LoginEventBuffer:
+    """Write-behind buffer for login audit events.
+
+    /login appends to an in-memory list and returns immediately; the events
+    are written with one insert_many when ``batch_size`` events are pending
+    or every ``flush_seconds``, whichever comes first. Events that fail to
+    insert are put back (up to ``max_pending``) so the next flush retries
+    them; events that did insert are added to the hourly login rollups.
+    Events being retried are remembered by _id, so one that an earlier,
+    apparently failed, insert did store is still counted in the rollups
+    when the retry reports it as a duplicate.
+    """
+
+    def __init__(self, collection, batch_size: int, flush_seconds: float, max_pending: int, rollups=None):
+        self.collection = collection
+        self.rollups = rollups
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.pending: List[dict] = []
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.flush_tasks: set = set()
+        self.stopping = asyncio.Event()
+        self.retry_ids: set = set()
+        self.stats = {
+            "flushes": 0,
+            "flushedEvents": 0,
+            "failedFlushes": 0,
+            "droppedEvents": 0,
+            "lastFlushSize": 0,
+            "lastFlushMs": 0.0,
+            "maxFlushMs": 0.0,
+            "lastFlushAt": None,
+        }
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """Stop the timer, let flushes in progress finish and write out everything still buffered."""
+        # The timer is stopped, not cancelled: cancelling it mid-flush would lose the batch it holds
+        self.stopping.set()
+        if self.task:
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await asyncio.gather(*self.flush_tasks, return_exceptions=True)
+        await self.flush()
+
+    def add(self, event: dict) -> None:
+        self.pending.append(event)
+        if len(self.pending) >= self.batch_size and not self.lock.locked():
+            # Keep a reference so the flush task is not garbage-collected mid-write
+            flush_task = asyncio.create_task(self.flush())
+            self.flush_tasks.add(flush_task)
+            flush_task.add_done_callback(self.flush_tasks.discard)
+
+    def metrics(self) -> dict:
+        return dict(self.stats, depth=len(self.pending))
+
+    async def flush(self) -> None:
+        async with self.lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, []
+            started = time.perf_counter()
+            try:
+                stored, failed = await self._insert(batch)
+            except asyncio.CancelledError:
+                # Keep the batch for the next flush; events that did insert come back as duplicates
+                self.retry_ids.update(event.get("_id") for event in batch)
+                self.pending = batch + self.pending
+                raise
+            self.retry_ids.difference_update(event.get("_id") for event in stored)
+            if stored and self.rollups is not None:
+                try:
+                    await increment_login_rollups(self.rollups, stored)
+                except Exception as e:
+                    # Counters drift until the next rebuild_login_rollups.py run; the raw events are safe
+                    print(f"❌ Login rollup update for {len(stored)} events failed: {e}")
+            if failed:
+                self.stats["failedFlushes"] += 1
+                self.retry_ids.update(event.get("_id") for event in failed)
+                self.pending = failed + self.pending
+                overflow = len(self.pending) - self.max_pending
+                if overflow > 0:
+                    # Drop the oldest events rather than grow without bound while Mongo is unavailable
+                    self.retry_ids.difference_update(event.get("_id") for event in self.pending[:overflow])
+                    del self.pending[:overflow]
+                    self.stats["droppedEvents"] += overflow
+                return
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.stats["flushes"] += 1
+            self.stats["flushedEvents"] += len(batch)
+            self.stats["lastFlushSize"] = len(batch)
+            self.stats["lastFlushMs"] = round(elapsed_ms, 2)
+            self.stats["maxFlushMs"] = round(max(self.stats["maxFlushMs"], elapsed_ms), 2)
+            self.stats["lastFlushAt"] = datetime.utcnow()
+
+    async def _insert(self, batch: List[dict]) -> tuple:
+        """insert_many the batch; returns (newly stored events, events to retry)."""
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+            return batch, []
+        except BulkWriteError as e:
+            # Events carry their own _id, so a duplicate key means an earlier attempt already stored
+            # it. That attempt only counted it if it reported success, i.e. if this is not a retry.
+            errors = e.details.get("writeErrors", [])
+            rejected = {
+                err["index"] for err in errors
+                if err.get("code") != 11000 or batch[err["index"]].get("_id") not in self.retry_ids
+            }
+            retry = [batch[err["index"]] for err in errors if err.get("code") != 11000]
+            if retry:
+                print(f"❌ Login audit flush of {len(batch)} events: {len(retry)} failed")
+            return [event for i, event in enumerate(batch) if i not in rejected], retry
+        except Exception as e:
+            print(f"❌ Login audit flush of {len(batch)} events failed: {e}")
+            return [], batch
+
+    async def _flush_periodically(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+# ========================
+# Login rollups
+# ========================
+# login_rollups holds one counter document per (UTC hour, role):
+#   {"hour": <UTC hour start>, "day": <UTC day start>, "role": "student", "count": 42}
+# The audit buffer $inc's them as events are stored, so login statistics
+# cost O(buckets) instead of a scan over the raw logins collection.
+
+def rollup_hour(login_time: datetime) -> datetime:
+    return login_time.replace(minute=0, second=0, microsecond=0)
+
+async def increment_login_rollups(rollups, events: List[dict]) -> None:
+    """Add stored login events to their hourly counters with one bulk write."""
+    counts = Counter((rollup_hour(event["time"]), event["role"]) for event in events)
+    ops = [
+        UpdateOne(
+            {"hour": hour, "role": role},
+            {"$inc": {"count": count}, "$setOnInsert": {"day": hour.replace(hour=0)}},
+            upsert=True
+        )
+        for (hour, role), count in counts.items()
+    ]
+    await rollups.bulk_write(ops, ordered=False)
+
+async def rebuild_login_rollups(db, since: Optional[datetime] = None, days_per_batch: int = 7,
+                                until: Optional[datetime] = None) -> int:
+    """Recompute login_rollups from the raw logins collection.
+
+    Works through the logins ``days_per_batch`` UTC days at a time: each
+    window is aggregated into hourly counts that overwrite the counters for
+    those hours in place, and counters for hours without raw logins are
+    removed. Days whose raw logins were already removed by the retention
+    job are skipped, since their counters can no longer be recomputed. By
+    default the rebuild stops before the current hour, which the audit
+    buffer is still $inc'ing. Returns the number of counter documents written.
+    """
+    logins_coll = db["logins"]
+    rollups_coll = db["login_rollups"]
+
+    if since is None:
+        oldest = await logins_coll.find_one({}, {"time": 1}, sort=[("time", 1)])
+        if not oldest:
+            return 0
+        since = oldest["time"]
+    window_start = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = until or rollup_hour(datetime.utcnow())
+
+    pruned = await db["login_retention"].find_one({"deleteStarted": True}, {"day": 1}, sort=[("day", -1)])
+    if pruned and window_start <= pruned["day"]:
+        window_start = pruned["day"] + timedelta(days=1)
+
+    written = 0
+    while window_start < end:
+        window_end = min(window_start + timedelta(days=days_per_batch), end)
+        pipeline = [
+            {"$match": {"time": {"$gte": window_start, "$lt": window_end}}},
+            {"$group": {
+                "_id": {"hour": {"$dateTrunc": {"date": "$time", "unit": "hour"}}, "role": "$role"},
+                "count": {"$sum": 1}
+            }}
+        ]
+        rebuilt_at = datetime.utcnow()
+        ops = [
+            UpdateOne(
+                {"hour": row["_id"]["hour"], "role": row["_id"]["role"]},
+                {"$set": {"count": row["count"], "day": row["_id"]["hour"].replace(hour=0), "rebuiltAt": rebuilt_at}},
+                upsert=True
+            )
+            async for row in logins_coll.aggregate(pipeline)
+        ]
+        if ops:
+            await rollups_coll.bulk_write(ops, ordered=False)
+        # Counters this pass did not touch have no raw logins behind them any more
+        await rollups_coll.delete_many({
+            "hour": {"$gte": window_start, "$lt": window_end}, "rebuiltAt": {"$ne": rebuilt_at}
+        })
+        written += len(ops)
+        print(f"✅ Rebuilt login rollups for {window_start} .. {window_end} ({len(ops)} counters)")
+        window_start = window_end
+    return written
+
+async def run_login_rollup_backfill(db, until: datetime) -> None:
+    """Background task: build login_rollups for the logins before ``until`` after a fresh deploy."""
+    try:
+        written = await rebuild_login_rollups(db, until=until)
+        print(f"✅ Backfilled {written} login rollup counters")
+    except Exception as e:
+        print(f"❌ Login rollup backfill failed: {e}")
+        raise
+
+def login_rollups_ready() -> bool:
+    """False while the startup backfill of login_rollups is still running, or if it failed."""
+    task = getattr(app, "rollup_backfill", None)
+    return task is None or (task.done() and not task.cancelled() and task.exception() is None)
+
+# ========================
+# Login retention
+# ========================
+# Each UTC day older than the retention window goes through three steps,
+# tracked in login_retention so an interrupted run resumes safely:
+#   1. compact: recompute that day's login_rollups from the raw events
+#   2. archive: write the raw events to <LOGIN_ARCHIVE_DIR>/logins-YYYY-MM-DD.ndjson.gz
+#      (MongoDB extended JSON, restorable with mongoimport)
+#   3. delete:  remove the raw events in batches, pausing between batches
+# Deletion only starts once steps 1 and 2 are recorded, and a day is never
+# compacted or archived again after deletion has begun.
+
+async def archive_login_day(logins_coll, day: datetime, archive_dir: str, batch_size: int) -> tuple:
+    """Write one UTC day of raw logins to a gzipped NDJSON file; returns (path, count)."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"logins-{day.date().isoformat()}.ndjson.gz")
+    tmp_path = path + ".tmp"
+    count = 0
+    lines = []
+    archive = await asyncio.to_thread(gzip.open, tmp_path, "wb")
+    try:
+        cursor = logins_coll.find({"time": {"$gte": day, "$lt": day + timedelta(days=1)}}).batch_size(batch_size)
+        async for login in cursor:
+            lines.append(json_util.dumps(login).encode("utf-8"))
+            count += 1
+            if len(lines) >= batch_size:
+                await asyncio.to_thread(archive.write, b"\n".join(lines) + b"\n")
+                lines = []
+        if lines:
+            await asyncio.to_thread(archive.write, b"\n".join(lines) + b"\n")
+    finally:
+        await asyncio.to_thread(archive.close)
+    os.replace(tmp_path, path)
+    return path, count
+
+async def delete_login_day(logins_coll, day: datetime, batch_size: int, pause_seconds: float) -> int:
+    """Delete one UTC day of raw logins in batches of ``batch_size``, pausing between batches."""
+    deleted = 0
+    day_range = {"time": {"$gte": day, "$lt": day + timedelta(days=1)}}
+    while True:
+        ids = [doc["_id"] async for doc in logins_coll.find(day_range, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            return deleted
+        result = await logins_coll.delete_many({"_id": {"$in": ids}})
+        deleted += result.deleted_count
+        await asyncio.sleep(pause_seconds)
+
+async def apply_login_retention(db, retention_days: int, archive_dir: str = LOGIN_ARCHIVE_DIR,
+                                batch_size: int = LOGIN_RETENTION_BATCH_SIZE,
+                                pause_seconds: float = LOGIN_RETENTION_PAUSE_SECONDS) -> int:
+    """Compact, archive and delete raw logins older than ``retention_days``. Returns events deleted."""
+    logins_coll = db["logins"]
+    state_coll = db["login_retention"]
+    cutoff = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=retention_days)
+
+    total_deleted = 0
+    while True:
+        oldest = await logins_coll.find_one({"time": {"$lt": cutoff}}, {"time": 1}, sort=[("time", 1)])
+        if not oldest:
+            return total_deleted
+        day = oldest["time"].replace(hour=0, minute=0, second=0, microsecond=0)
+        state = await state_coll.find_one({"day": day}) or {}
+
+        if not state.get("deleteStarted"):
+            if not state.get("compacted"):
+                await rebuild_login_rollups(db, since=day, until=day + timedelta(days=1))
+                await state_coll.update_one({"day": day}, {"$set": {"compacted": True}}, upsert=True)
+            path, count = await archive_login_day(logins_coll, day, archive_dir, batch_size)
+            await state_coll.update_one(
+                {"day": day},
+                {"$set": {"archive": path, "archivedCount": count, "deleteStarted": True}}
+            )
+            print(f"✅ Archived {count} logins from {day.date()} to {path}")
+
+        deleted = await delete_login_day(logins_coll, day, batch_size, pause_seconds)
+        await state_coll.update_one({"day": day}, {"$set": {"deletedAt": datetime.utcnow()}, "$inc": {"deletedCount": deleted}})
+        print(f"✅ Removed {deleted} raw logins from {day.date()}")
+        total_deleted += deleted
+
+async def run_login_retention_periodically(db) -> None:
+    """Background task: apply the retention policy every LOGIN_RETENTION_INTERVAL_HOURS."""
+    while True:
+        try:
+            await apply_login_retention(db, LOGIN_RETENTION_DAYS)
+        except Exception as e:
+            print(f"❌ Login retention run failed: {e}")
+        await asyncio.sleep(LOGIN_RETENTION_INTERVAL_HOURS * 3600)
+
+@app.get("/metrics/login-audit", response_description="Login audit buffer metrics")
+async def login_audit_metrics():
+    """Buffer depth and flush latency of the login audit write-behind buffer."""
+    return MongoJSONResponse(app.login_audit.metrics())
+
 # ========================
 # Routes
 # ========================
@@ -405,6 +1335,7 @@ async def register_user(user: User):
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Username already exists")
     
     user_dict = user.dict()
+    user_dict["password"] = await hash_password(user.password)
     try:
         result = await users_collection.insert_one(user_dict)
         return {"status": "success", "id": str(result.inserted_id)}
@@ -417,12 +1348,21 @@ from datetime import datetime
 async def login_user(user: User):
     """Authenticate a user, log their login time, and return data."""
     users_collection = app.mongodb["Users"]
-    db_user = await users_collection.find_one({"username": user.username, "password": user.password})
+    db_user = await users_collection.find_one({"username": user.username})
 
-    if not db_user:
+    if not db_user or not await verify_password(user.password, db_user.get("password")):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password")
 
     user_role = db_user.get("role", "student")
+
+    # Upgrade legacy plaintext rows (and hashes with an old work factor) now that we know the password
+    stored_password = db_user.get("password")
+    if not is_password_hash(stored_password) or needs_rehash(stored_password):
+        password_hash = await hash_password(user.password)
+        await users_collection.update_one({"_id": db_user["_id"]}, {"$set": {"password": password_hash}})
+        if user_role == "student":
+            await app.mongodb["Students"].update_one({"UserID": user.username}, {"$set": {"Password": password_hash}})
+
     response_data = {
         "status": "success",
         "message": "Login successful",
@@ -430,38 +1370,46 @@ async def login_user(user: User):
     }
 
     # If the user is a student, fetch their detailed data
+    student_names = {}
     if user_role == "student":
         Students_collection = app.mongodb["Students"]
-        student_details = await Students_collection.find_one({"UserID": user.username})
-        if student_details:
-            student_details["_id"] = str(student_details["_id"])
-            response_data["user_data"] = student_details
-        else:
-            response_data["user_data"] = None
-
-    # ✅ Save login activity for monitoring with timezone-aware datetime
-    logins_collection = app.mongodb["logins"]
-    await logins_collection.insert_one({
+        student_details = await Students_collection.find_one({"UserID": user.username}, {"Password": 0})
+        response_data["user_data"] = student_details
+        if student_details and "Student Name" in student_details:
+            student_names[user.username] = student_details["Student Name"]
+
+    # ✅ Record login activity for monitoring; written in the background by the audit buffer.
+    # The _id is assigned here so the stored event and the in-memory copy share one identity,
+    # and the time is truncated to the millisecond precision Mongo stores.
+    now = datetime.utcnow()
+    login_event = {
+        "_id": ObjectId(),
         "username": user.username,
         "role": user_role,
-        "time": datetime.utcnow()
-    })
+        "time": now.replace(microsecond=now.microsecond // 1000 * 1000)
+    }
+    app.login_audit.add(dict(login_event))
+    student_name = login_display_name(user.username, user_role, student_names)
+    app.recent_logins.add(dict(login_event, studentName=student_name))
+    app.login_hub.publish(format_login_entry(login_event, student_name))
 
-    return response_data
+    return MongoJSONResponse(response_data)
 
 
 @app.get("/users", response_description="List all users", response_model=List[UserOut])
 async def list_users():
     users_collection = app.mongodb["Users"]  # Fixed collection name
-    users = []
     try:
-        async for u in users_collection.find():
-            users.append(UserOut.model_validate(u))
-        return users
+        # Project to the UserOut fields so passwords never leave the database
+        users = await users_collection.find({}, {"username": 1, "role": 1}).to_list(length=None)
+        return MongoJSONResponse(users)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error fetching users: {str(e)}")
 
 # === NEW: Student Routes ===
+# Random STU#### usernames tried per new student before giving up
+STUDENT_USERNAME_ATTEMPTS = 50
+
 @app.post("/Students/add", status_code=status.HTTP_201_CREATED)
 async def add_student(student: dict):
     """Adds a new student with auto-generated username and password, and creates a user login."""
@@ -473,27 +1421,39 @@ async def add_student(student: dict):
     if await Students_collection.find_one({"Admission No": student.get("Admission No")}):
         raise HTTPException(status_code=409, detail="Student with this Admission Number already exists.")
 
-    # ✅ Auto-generate username and password
-    username = f"STU{random.randint(1000, 9999)}"
+    # ✅ Auto-generate password
     try:
         year, month, day = student.get("dob", "").split("-")
         password = f"{day}{month}{year}"
     except:
         password = "Pass@123"
+    password_hash = await hash_password(password)
+
+    # Save in Users collection under a free auto-generated username; the unique
+    # username_1 index rejects one that another request took in the meantime
+    for _ in range(STUDENT_USERNAME_ATTEMPTS):
+        username = f"STU{random.randint(1000, 9999)}"
+        if await Students_collection.find_one({"UserID": username}, {"_id": 1}):
+            continue
+        try:
+            await users_collection.insert_one({
+                "username": username,
+                "password": password_hash,
+                "role": "student"
+            })
+            break
+        except DuplicateKeyError:
+            continue
+    else:
+        raise HTTPException(status_code=503, detail="Could not find a free student username, try again")
 
-    # Save in Students collection
+    # Save in Students collection (the plaintext password is only returned once, below)
     student["UserID"] = username
-    student["Password"] = password
+    student["Password"] = password_hash
+    if isinstance(student.get("Email"), str):
+        student["EmailNormalized"] = normalize_email(student["Email"])
     await Students_collection.insert_one(student)
 
-    # Save in Users collection
-    user_credentials = {
-        "username": username,
-        "password": password,
-        "role": "student"
-    }
-    await users_collection.insert_one(user_credentials)
-
     return {
         "status": "success",
         "message": "Student added successfully",
@@ -501,23 +1461,131 @@ async def add_student(student: dict):
         "password": password
     }
 
+async def dedupe_users(db) -> int:
+    """Give every Users document that shares its username with an older one a free username.
+
+    Such duplicates could be created by add_student before username_1 was
+    unique; only the oldest of them could log in. Each renamed account gets
+    "<username>-<n>" and its Students record (matched by UserID and
+    password) follows; the renames are logged so the students can be told.
+    Returns the number of accounts renamed.
+    """
+    users_coll = db["Users"]
+    pipeline = [
+        {"$group": {"_id": "$username", "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ]
+    renamed = 0
+    async for group in users_coll.aggregate(pipeline, allowDiskUse=True):
+        username = group["_id"]
+        suffix = 1
+        for user_id in sorted(group["ids"])[1:]:
+            new_username = username
+            while await users_coll.find_one({"username": new_username}, {"_id": 1}):
+                suffix += 1
+                new_username = f"{username}-{suffix}"
+            user = await users_coll.find_one_and_update(
+                {"_id": user_id}, {"$set": {"username": new_username}}, return_document=ReturnDocument.AFTER
+            )
+            if user.get("role", "student") == "student":
+                await db["Students"].update_one(
+                    {"UserID": username, "Password": user.get("password")}, {"$set": {"UserID": new_username}}
+                )
+            print(f"⚠️ Renamed duplicate user {username} ({user_id}) to {new_username}")
+            renamed += 1
+    return renamed
+
+# Page size bounds for /students; each request touches at most STUDENTS_PAGE_MAX documents
+STUDENTS_PAGE_DEFAULT = 100
+STUDENTS_PAGE_MAX = 500
+
+def encode_cursor(last_id: ObjectId) -> str:
+    """Encode the last _id of a page into an opaque, URL-safe cursor."""
+    return base64.urlsafe_b64encode(last_id.binary).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> ObjectId:
+    """Decode a cursor produced by encode_cursor back into an ObjectId."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return ObjectId(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+def parse_projection(fields: Optional[str]) -> dict:
+    """Turn a comma-separated field list into a Mongo projection (always keeps _id, never Password)."""
+    if not fields:
+        return {"Password": 0}
+    projection = {name.strip(): 1 for name in fields.split(",") if name.strip() and name.strip() != "Password"}
+    projection["_id"] = 1  # _id is the pagination key, never drop it
+    return projection
+
 @app.get("/students")
-async def list_students():
+async def list_students(
+    request: Request,
+    limit: int = Query(STUDENTS_PAGE_DEFAULT, ge=1, le=STUDENTS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """Return one page of students, newest first, keyed on _id.
+
+    Pass the X-Next-Cursor response header back as ``cursor`` to fetch the next
+    page; the header is absent on the last page. ``fields`` is a comma-separated
+    projection, e.g. ``fields=Student Name,Admission No``. Send
+    ``Accept: application/bson`` to receive the page as raw BSON.
+    """
     students_collection = app.mongodb["Students"]  # Fixed collection name
+    raw = wants_raw_bson(request)
+    if raw:
+        students_collection = students_collection.with_options(codec_options=RAW_BSON_OPTIONS)
+
+    query = {}
+    if cursor:
+        query["_id"] = {"$lt": decode_cursor(cursor)}
+
+    # Fetch one extra document to know whether another page exists
+    students_cursor = students_collection.find(query, parse_projection(fields)).sort("_id", -1).limit(limit + 1)
+    students = await students_cursor.to_list(length=limit + 1)
 
-    # Fetch all documents
-    students_cursor = students_collection.find()
-    students = []
-    async for s in students_cursor:
-        students.append(s)
+    headers = {}
+    if len(students) > limit:
+        students = students[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(students[-1]["_id"])
 
-    # Serialize using bson.json_util
-    students_json = json.loads(json_util.dumps(students))
+    if raw:
+        return RawBSONResponse(students, headers=headers)
+    return MongoJSONResponse(students, headers=headers)
 
-    # Return as FastAPI JSONResponse
-    return JSONResponse(content=students_json)
 
 
+# Number of documents encoded per chunk of the NDJSON export stream
+EXPORT_BATCH_SIZE = 500
+
+@app.get("/students/export")
+async def export_students(
+    fields: Optional[str] = None,
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=5000),
+):
+    """Stream every student as newline-delimited JSON, newest first.
+
+    Documents are read from the Motor cursor and encoded ``batch_size`` at a
+    time, so at most one batch is ever held in memory and the first bytes go
+    out before the whole roster has been read.
+    """
+    students_collection = app.mongodb["Students"]
+
+    async def generate_ndjson():
+        cursor = students_collection.find({}, parse_projection(fields)).sort("_id", -1).batch_size(batch_size)
+        lines = []
+        async for s in cursor:
+            lines.append(encode_json(s))
+            if len(lines) >= batch_size:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+
+    return StreamingResponse(generate_ndjson(), media_type="application/x-ndjson")
+
 
 # === NEW: Academics Route ===
 @app.post("/academics/add", response_description="Add academic data for a student", status_code=status.HTTP_201_CREATED)
@@ -549,11 +1617,7 @@ async def get_academic_data(studentId: str):
     """Fetches all academic performance entries for a student by ID."""
     academics_collection = app.mongodb["academics"]
 
-    cursor = academics_collection.find({"studentId": studentId})
-    results = []
-    async for record in cursor:
-        record["_id"] = str(record["_id"])  # Convert ObjectId to string
-        results.append(record)
+    results = await academics_collection.find({"studentId": studentId}).to_list(length=None)
 
     if not results:
         raise HTTPException(
@@ -561,7 +1625,7 @@ async def get_academic_data(studentId: str):
             detail=f"No academic data found for student {studentId}"
         )
 
-    return {"status": "success", "data": results}
+    return MongoJSONResponse({"status": "success", "data": results})
 
 
 
@@ -582,8 +1646,7 @@ async def get_latest_academic(studentId: str):
             detail=f"No academic data found for student {studentId}"
         )
 
-    record["_id"] = str(record["_id"])  # Convert ObjectId to string
-    return {"status": "success", "data": record}
+    return MongoJSONResponse({"status": "success", "data": record})
 
 
 from fastapi import Body
@@ -728,13 +1791,12 @@ async def get_student_by_admission_no(admission_no: str):
     Students_collection = app.mongodb["Students"]
 
     # Strip spaces and match exactly
-    student = await Students_collection.find_one({"Admission No": admission_no.strip()})
+    student = await Students_collection.find_one({"Admission No": admission_no.strip()}, {"Password": 0})
     
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    student.pop("_id", None)
-    return student
+    return MongoJSONResponse(student)
 
 
 
@@ -743,15 +1805,22 @@ async def update_student_by_admission_no(admission_no: str, updated_data: dict):
     Students_collection = app.mongodb["Students"]
 
     # Fields that cannot be changed
-    immutable_fields = ["Admission No", "UserID", "Password"]
+    immutable_fields = ["Admission No", "UserID", "Password", "EmailNormalized"]
 
     # Remove them if present in request
     for field in immutable_fields:
         updated_data.pop(field, None)
 
+    # Keep the lookup key in step with Email; a cleared or non-string Email drops it
+    update = {"$set": updated_data}
+    if isinstance(updated_data.get("Email"), str):
+        updated_data["EmailNormalized"] = normalize_email(updated_data["Email"])
+    elif "Email" in updated_data:
+        update["$unset"] = {"EmailNormalized": ""}
+
     result = await Students_collection.update_one(
         {"Admission No": admission_no.strip()},
-        {"$set": updated_data}
+        update
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Student not found")
@@ -762,87 +1831,297 @@ async def update_student_by_admission_no(admission_no: str, updated_data: dict):
 
 
 
-@app.get("/monitor", response_description="Get last 10 logins")
-async def monitor():
-    """Return the last 10 login activities."""
-    logins_collection = app.mongodb["logins"]
-    students_collection = app.mongodb["Students"]
+# Page size bounds for /monitor
+MONITOR_PAGE_DEFAULT = 10
+MONITOR_PAGE_MAX = 100
 
+def encode_login_cursor(login_time: datetime, login_id: ObjectId) -> str:
+    """Opaque /monitor cursor for the (time, _id) position of a login event."""
+    millis = int(login_time.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    return base64.urlsafe_b64encode(struct.pack(">q", millis) + login_id.binary).decode("ascii").rstrip("=")
+
+def decode_login_cursor(cursor: str) -> tuple:
+    """Inverse of encode_login_cursor: (naive UTC datetime, ObjectId)."""
+    try:
+        raw = base64.urlsafe_b64decode((cursor + "=" * (-len(cursor) % 4)).encode("ascii"))
+        (millis,) = struct.unpack(">q", raw[:8])
+        login_time = datetime.fromtimestamp(millis / 1000, tz=timezone.utc).replace(tzinfo=None)
+        return login_time, ObjectId(raw[8:])
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+async def resolve_student_names(db, usernames) -> dict:
+    """Map UserID -> Student Name for many students with one query."""
+    names = {}
+    if not usernames:
+        return names
+    cursor = db["Students"].find({"UserID": {"$in": list(usernames)}}, {"UserID": 1, "Student Name": 1})
+    async for student in cursor:
+        if "Student Name" in student:
+            names[student["UserID"]] = student["Student Name"]
+    return names
+
+def login_display_name(username: str, role: str, student_names: dict) -> str:
+    if role == "student":
+        return student_names.get(username, "Unknown")
+    if role == "admin":
+        return "Admin User"
+    return f"{role.title()} User"
+
+def format_login_entry(login: dict, student_name: str) -> dict:
+    """Shape a logins document the way /monitor returns it."""
     # Fix timezone issue by adjusting for the 3-hour offset
     # This is a temporary fix until we update all datetime.utcnow() calls
-    cursor = logins_collection.find().sort("time", -1).limit(15)
-    last_logins = []
-    count = 0
-    
-    async for login in cursor:
-        # Adjust for timezone offset (subtract 3 hours)
-        adjusted_time = login["time"] - timedelta(hours=3)
-        
-        username = login["username"]
-        role = login["role"]
-        student_name = "Unknown"
-        
-        # Only look up student name for student roles
-        if role == "student":
-            student = await students_collection.find_one({"UserID": username})
-            if student and "Student Name" in student:
-                student_name = student["Student Name"]
-        elif role == "admin":
-            student_name = "Admin User"
-        else:
-            student_name = f"{role.title()} User"
-        
-        login_entry = {
-            "username": username,
-            "role": role,
-            "time": adjusted_time.strftime("%Y-%m-%d %H:%M:%S"),
-            "studentName": student_name
-        }
-        
-        last_logins.append(login_entry)
-        count += 1
-        
-        # Only take the first 10 after adjustment
-        if count >= 10:
-            break
+    adjusted_time = login["time"] - timedelta(hours=3)
+    return {
+        "username": login["username"],
+        "role": login["role"],
+        "time": adjusted_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "studentName": student_name
+    }
+
+class RecentLoginsRing:
+    """Bounded in-memory copy of the newest login events, oldest first.
+
+    login_user appends every event already enriched with the student name,
+    so /monitor can answer from memory without touching Mongo. The ring is
+    seeded from the logins collection at startup; until then, or when a
+    page reaches past the oldest event held, page() returns None and the
+    caller falls back to Mongo. Events are per process, which matches the
+    single uvicorn worker this API runs as.
+    """
+
+    def __init__(self, capacity: int):
+        self.entries: deque = deque(maxlen=capacity)
+        self.seeded = False
+        self.has_older = True  # whether Mongo may hold events older than the ring
+
+    def seed(self, newest_first: List[dict], has_older: bool) -> None:
+        """Load history from Mongo, keeping any events added since startup."""
+        known = {entry["_id"] for entry in newest_first}
+        added = [entry for entry in self.entries if entry["_id"] not in known]
+        self.entries.clear()
+        self.entries.extend(reversed(newest_first))
+        self.entries.extend(added)
+        self.has_older = has_older or len(newest_first) + len(added) > self.entries.maxlen
+        self.seeded = True
+
+    def add(self, entry: dict) -> None:
+        if len(self.entries) == self.entries.maxlen:
+            self.has_older = True
+        self.entries.append(entry)
+
+    def page(self, limit: int, before: Optional[tuple] = None) -> Optional[List[dict]]:
+        """Newest-first page strictly older than ``before`` (time, _id), or None if the ring can't cover it."""
+        if not self.seeded:
+            return None
+        result = []
+        for entry in reversed(self.entries):
+            if before is not None and (entry["time"], entry["_id"]) >= before:
+                continue
+            result.append(entry)
+            if len(result) == limit:
+                return result
+        return None if self.has_older else result
+
+class LoginSubscriber:
+    """One connected /monitor/stream client."""
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+class LoginEventHub:
+    """In-process pub/sub fanning login events out to /monitor/stream clients.
+
+    publish() never waits: each subscriber has its own bounded queue, and a
+    subscriber that falls behind loses its oldest undelivered events rather
+    than slowing down /login or the other dashboards.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscribers: set = set()
+
+    def subscribe(self) -> LoginSubscriber:
+        subscriber = LoginSubscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: LoginSubscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def publish(self, entry: dict) -> None:
+        for subscriber in self.subscribers:
+            if subscriber.queue.full():
+                subscriber.queue.get_nowait()
+                subscriber.dropped += 1
+            subscriber.queue.put_nowait(entry)
+
+async def seed_recent_logins(db, ring: RecentLoginsRing) -> None:
+    """Fill the ring with the newest logins from Mongo, with student names resolved."""
+    capacity = ring.entries.maxlen
+    logins = await db["logins"].find().sort([("time", -1), ("_id", -1)]).limit(capacity).to_list(length=capacity)
+    student_names = await resolve_student_names(db, {login["username"] for login in logins if login["role"] == "student"})
+    for login in logins:
+        login["studentName"] = login_display_name(login["username"], login["role"], student_names)
+    ring.seed(logins, has_older=len(logins) == capacity)
+
+@app.get("/monitor", response_description="Get recent logins")
+async def monitor(
+    limit: int = Query(MONITOR_PAGE_DEFAULT, ge=1, le=MONITOR_PAGE_MAX),
+    before: Optional[str] = None,
+):
+    """Return the most recent login activities, newest first.
+
+    Pass ``nextBefore`` from a response as ``before`` to page further back.
+    Pages are served from the in-memory ring of recent logins; only pages
+    it cannot cover hit Mongo, with student names resolved in one query.
+    """
+    position = decode_login_cursor(before) if before else None
+
+    logins = app.recent_logins.page(limit, position)
+    if logins is not None:
+        last_logins = [format_login_entry(login, login["studentName"]) for login in logins]
+    else:
+        query = {}
+        if position:
+            before_time, before_id = position
+            query = {"$or": [
+                {"time": {"$lt": before_time}},
+                {"time": before_time, "_id": {"$lt": before_id}},
+            ]}
+
+        logins_collection = app.mongodb["logins"]
+        logins = await logins_collection.find(query).sort([("time", -1), ("_id", -1)]).limit(limit).to_list(length=limit)
+
+        student_usernames = {login["username"] for login in logins if login["role"] == "student"}
+        student_names = await resolve_student_names(app.mongodb, student_usernames)
+        last_logins = [
+            format_login_entry(login, login_display_name(login["username"], login["role"], student_names))
+            for login in logins
+        ]
+
+    next_before = None
+    if len(logins) == limit:
+        next_before = encode_login_cursor(logins[-1]["time"], logins[-1]["_id"])
+
+    return MongoJSONResponse({"last_logins": last_logins, "nextBefore": next_before})
+
+
+@app.get("/monitor/stream", response_description="Live login activity (server-sent events)")
+async def monitor_stream(request: Request):
+    """Stream new logins as server-sent events.
+
+    Each login is sent as an ``event: login`` frame whose data has the same
+    shape as a /monitor entry. A ``: heartbeat`` comment is sent after
+    LOGIN_STREAM_HEARTBEAT_SECONDS of silence to keep proxies from closing
+    the connection.
+    """
+    subscriber = app.login_hub.subscribe()
+
+    async def event_frames():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    entry = await asyncio.wait_for(subscriber.queue.get(), timeout=LOGIN_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": heartbeat\n\n"
+                    continue
+                yield b"event: login\ndata: " + encode_json(entry) + b"\n\n"
+        finally:
+            app.login_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        event_frames(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Bucket sizes accepted by /weekly-app-usage (passed to $dateTrunc as "unit")
+USAGE_GRANULARITIES = ("hour", "day", "week")
+
+def resolve_timezone(tz: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown timezone: {tz}")
+
+def usage_buckets(granularity: str, periods: int, zone: ZoneInfo, now: datetime) -> List[datetime]:
+    """Start of each of the last ``periods`` buckets (tz-aware, oldest first), ending with the current one.
+
+    One extra start is appended at the end: the (exclusive) end of the range.
+    """
+    local_now = now.astimezone(zone)
+    if granularity == "hour":
+        # Step in UTC so DST transitions neither repeat nor skip an hour
+        current = local_now.replace(minute=0, second=0, microsecond=0).astimezone(timezone.utc)
+        return [(current - timedelta(hours=i)).astimezone(zone) for i in range(periods - 1, -2, -1)]
+    today = local_now.date()
+    if granularity == "week":
+        monday = today - timedelta(days=today.weekday())
+        days = [monday - timedelta(weeks=i) for i in range(periods - 1, -2, -1)]
+    else:
+        days = [today - timedelta(days=i) for i in range(periods - 1, -2, -1)]
+    return [datetime.combine(day, datetime.min.time(), tzinfo=zone) for day in days]
+
+def bucket_label(start: datetime, granularity: str) -> str:
+    if granularity == "hour":
+        return start.strftime("%Y-%m-%dT%H:%M")
+    return start.date().isoformat()
 
-    return {"last_logins": last_logins}
+def to_naive_utc(value: datetime) -> datetime:
+    """Convert an aware datetime to the naive UTC form stored in Mongo."""
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
 
+def whole_hour_offsets(starts: List[datetime]) -> bool:
+    """True if every bucket boundary falls on a UTC hour, so hourly rollups can be re-bucketed exactly."""
+    return all(start.utcoffset().total_seconds() % 3600 == 0 for start in starts)
 
 @app.get("/weekly-app-usage", response_description="Get login statistics for the past week")
-async def get_weekly_app_usage():
-    """Return login statistics for all students for the past week."""
-    logins_coll = app.mongodb["logins"]
-    
-    # Calculate date range for the past 7 days
-    end_date = datetime.utcnow().date()
-    start_date = end_date - timedelta(days=7)
-    
-    # Initialize data structure for each day of the week
-    daily_stats = {}
-    for i in range(7):
-        date = start_date + timedelta(days=i)
-        daily_stats[date.isoformat()] = {
-            "date": date.isoformat(),
-            "entryCount": 0
-        }
-    
-    # Fetch login data for the past week
-    cursor = logins_coll.find({
-        "time": {
-            "$gte": datetime(start_date.year, start_date.month, start_date.day),
-            "$lte": datetime(end_date.year, end_date.month, end_date.day)
-        }
-    })
-    
-    # Count entries per day
-    async for record in cursor:
-        login_date = record["time"].date().isoformat()
-        if login_date in daily_stats:
-            daily_stats[login_date]["entryCount"] += 1
-    
-    # Convert to list format
-    daily_entries = list(daily_stats.values())
+async def get_weekly_app_usage(
+    periods: int = Query(7, ge=1, le=1000),
+    granularity: str = Query("day", pattern=f"^({'|'.join(USAGE_GRANULARITIES)})$"),
+    tz: str = "UTC",
+    role: Optional[str] = None,
+):
+    """Return login counts per bucket for the last ``periods`` buckets, including the current one.
+
+    Defaults to one bucket per day for the past 7 days, optionally for one
+    ``role``. Counts are summed from the hourly login_rollups counters with
+    $group on $dateTrunc in the requested timezone, so only the bucket
+    totals are transferred. Timezones with a non-whole-hour offset can't be
+    served from hourly counters and are counted from the raw logins instead,
+    as is everything while the rollups are still being backfilled.
+    """
+    zone = resolve_timezone(tz)
+
+    starts = usage_buckets(granularity, periods, zone, datetime.now(timezone.utc))
+    range_start, range_end = to_naive_utc(starts[0]), to_naive_utc(starts[-1])
+    truncate = {"unit": granularity, "timezone": tz, "startOfWeek": "monday"}
+
+    if whole_hour_offsets(starts) and login_rollups_ready():
+        source = app.mongodb["login_rollups"]
+        match = {"hour": {"$gte": range_start, "$lt": range_end}}
+        group = {"_id": {"$dateTrunc": dict(truncate, date="$hour")}, "entryCount": {"$sum": "$count"}}
+    else:
+        source = app.mongodb["logins"]
+        match = {"time": {"$gte": range_start, "$lt": range_end}}
+        group = {"_id": {"$dateTrunc": dict(truncate, date="$time")}, "entryCount": {"$sum": 1}}
+    if role:
+        match["role"] = role
+
+    pipeline = [{"$match": match}, {"$group": group}]
+    counts = {}
+    async for bucket in source.aggregate(pipeline):
+        counts[bucket["_id"]] = bucket["entryCount"]
+
+    # Fill in empty buckets so the chart always gets ``periods`` points
+    daily_entries = [
+        {"date": bucket_label(start, granularity), "entryCount": counts.get(to_naive_utc(start), 0)}
+        for start in starts[:-1]
+    ]
     
     # Calculate statistics
     entry_counts = [day["entryCount"] for day in daily_entries]
@@ -850,14 +2129,16 @@ async def get_weekly_app_usage():
     average_entries = total_entries / len(entry_counts) if entry_counts else 0
     highest_entries = max(entry_counts) if entry_counts else 0
     
-    return {
+    return MongoJSONResponse({
+        "granularity": granularity,
+        "timezone": tz,
         "daily_entries": daily_entries,
         "statistics": {
             "total_entries": total_entries,
             "average_entries": round(average_entries, 2),
             "highest_entries": highest_entries
         }
-    }
+    })
 
 
 # ==========================
@@ -965,352 +2246,1438 @@ async def get_weekly_app_usage():
 
 # router = APIRouter()
 
-# ===============================
-# Generate and save recommendations
-# ===============================
-# @app.post("/recommendations/generate_all", response_description="Generate recommendations for all students")
-# async def generate_all_recommendations():
-#     students_coll = app.mongodb["Students"]
-#     academics_coll = app.mongodb["academics"]
-#     phone_coll = app.mongodb["PhoneUsage"]
-#     rec_coll = app.mongodb["recommendations"]
-
-#     students_cursor = students_coll.find({})
-#     count = 0
-
-#     async for student in students_cursor:
-#         student_id = student.get("UserID")
-#         if not student_id:
-#             continue
-
-#         # --- Fetch latest academic data ---
-#         academic_records = academics_coll.find({"studentId": student_id})
-#         total_marks = 0
-#         total_study_hours = 0
-#         total_focus = 0
-#         num_records = 0
-#         async for rec in academic_records:
-#             subjects = rec.get("subjects", [])
-#             if subjects:
-#                 total_marks += sum(s.get("mark", 0) for s in subjects) / len(subjects)
-#             total_study_hours += float(rec.get("studyHours", 0))
-#             total_focus += float(rec.get("focusLevel", 0))
-#             num_records += 1
-
-#         if num_records == 0:
-#             continue  # skip students with no academic data
-
-#         avg_mark = total_marks / num_records
-#         avg_study_hours = total_study_hours / num_records
-#         avg_focus = total_focus / num_records
-
-#         # --- Fetch last 14 days of phone usage ---
-#         end_date = datetime.utcnow().date() - timedelta(days=1)
-#         start_date = end_date - timedelta(days=13)
-#         phone_cursor = phone_coll.find({
-#             "studentId": student_id,
-#             "date": {"$gte": datetime(start_date.year, start_date.month, start_date.day),
-#                      "$lte": datetime(end_date.year, end_date.month, end_date.day)}
-#         })
-
-#         total_screen = 0
-#         total_night = 0
-#         total_academic_ratio = 0
-#         phone_days = 0
-
-#         async for day in phone_cursor:
-#             screen = day.get("screenTime", 0)
-#             night = day.get("nightUsage", 0)
-#             apps = day.get("appsUsed", [])
-#             academic_minutes = sum(a.get("durationMinutes", 0) for a in apps if a.get("appName") in [
-#                 "Google Classroom", "Zoom", "Docs", "Google Meet", "Khan Academy", "Coursera"])
-#             academic_ratio = academic_minutes / screen if screen > 0 else 0
-
-#             total_screen += screen
-#             total_night += night
-#             total_academic_ratio += academic_ratio
-#             phone_days += 1
-
-#         if phone_days == 0:
-#             avg_screen = 0
-#             avg_night = 0
-#             avg_academic_ratio = 0
-#         else:
-#             avg_screen = total_screen / phone_days
-#             avg_night = total_night / phone_days
-#             avg_academic_ratio = total_academic_ratio / phone_days
+# 
+from fastapi import HTTPException
+from datetime import datetime, timedelta, timezone
 
-#         # --- Generate recommendations ---
-#         recs = []
+# ==========================
+# App categories
+# ==========================
+# Every app name seen in PhoneUsage.appsUsed belongs to one category. When a
+# PhoneUsage document is written, its minutes are totalled per category
+# into categoryMinutes and stamped with the registry version they were
+# computed under (categoryVersion), so readers never walk appsUsed. After
+# changing the registry, bump APP_CATEGORY_VERSION: documents from older
+# versions are recomputed by backfill_app_categories(), which runs in the
+# background on startup and from backfill_app_categories.py.
+APP_CATEGORY_VERSION = 1
+APP_CATEGORIES = {
+    "Google Classroom": "academic",
+    "Zoom": "academic",
+    "Docs": "academic",
+    "Google Meet": "academic",
+    "Khan Academy": "academic",
+    "Coursera": "academic",
+    "YouTube": "entertainment",
+    "Netflix": "entertainment",
+    "Spotify": "entertainment",
+    "Instagram": "social",
+    "WhatsApp": "social",
+    "Snapchat": "social",
+    "Telegram": "social",
+    "Facebook": "social",
+}
+# Apps missing from the registry are counted here
+DEFAULT_APP_CATEGORY = "other"
+APP_CATEGORY_NAMES = ["academic", "entertainment", "social", DEFAULT_APP_CATEGORY]
+
+# Apps whose minutes count towards the academic app ratio
+ACADEMIC_APPS = [app_name for app_name, category in APP_CATEGORIES.items() if category == "academic"]
+
+def categorize_phone_usage(apps_used: Optional[list]) -> dict:
+    """Return the categoryMinutes / categoryVersion fields to store with a PhoneUsage document."""
+    minutes = dict.fromkeys(APP_CATEGORY_NAMES, 0)
+    for a in apps_used or []:
+        minutes[APP_CATEGORIES.get(a.get("appName"), DEFAULT_APP_CATEGORY)] += a.get("durationMinutes", 0)
+    return {"categoryMinutes": minutes, "categoryVersion": APP_CATEGORY_VERSION}
+
+async def backfill_app_categories(db, batch_size: int = 500) -> int:
+    """Recompute categoryMinutes on PhoneUsage days from other registry versions.
+
+    Runs in batches of about ``batch_size`` days, rebuilds the usage windows
+    and bumps the PhoneUsage version of every student touched, so their
+    cached recommendations are rebuilt. Returns the number of days updated.
+    """
+    updated = 0
+    async for batch_updated, student_ids in create_phone_usage_store(db).backfill_categories(batch_size):
+        updated += batch_updated
+        await rebuild_usage_windows(db, student_ids)
+        await bump_phone_usage_versions(db, student_ids)
+    return updated
+
+async def run_app_category_backfill(db) -> None:
+    """Background task: bring PhoneUsage written under an older registry up to date."""
+    try:
+        updated = await backfill_app_categories(db)
+        if updated:
+            print(f"✅ Recategorized {updated} PhoneUsage documents (registry v{APP_CATEGORY_VERSION})")
+    except Exception as e:
+        print(f"❌ PhoneUsage category backfill failed: {e}")
 
-#         if avg_mark < 60:
-#             recs.append("Maintain study routine; try active recall.")
-#         if avg_focus < 5:
-#             recs.append("Improve focus during study sessions; reduce distractions.")
-#         if avg_night > 90:
-#             recs.append("Avoid late-night phone usage to improve sleep.")
-#         if avg_academic_ratio < 0.5:
-#             recs.append("Increase use of academic apps to boost productivity.")
+# ==========================
+# PhoneUsage storage
+# ==========================
+# Daily usage is kept in one of two layouts, chosen by PHONE_USAGE_LAYOUT:
+#   daily   - PhoneUsage: one document per student per day
+#   monthly - PhoneUsageMonthly: one bucket per student per calendar month,
+#             {studentId, month, categoryVersion, days: {"01": {...}, ..., "31": {...}}}
+# Each bucket's days hold the same fields as a daily document, plus its date.
+# A 14-day window touches at most two buckets, and the (studentId, month)
+# index has about 1/30th of the entries of studentId_1_date_1. Everything
+# that reads or writes PhoneUsage goes through a PhoneUsageStore, so the
+# layout can be switched after copying the data with
+# migrate_phone_usage_layout.py.
+
+def phone_usage_feature_stages(prefix: str = "") -> list:
+    """$project/$group stages that reduce day records to per-student averages.
+
+    The server-side counterpart of summarize_phone_usage(): academic minutes
+    come from the stored categoryMinutes (records written before the
+    registry existed fall back to summing appsUsed with $filter until the
+    backfill reaches them), and each student comes back as one
+    {_id, avgScreen, avgNight, avgAcademicRatio} row. ``prefix`` is the
+    path of the day fields within each input document ("" for daily
+    documents).
+    """
+    return [
+        {"$project": {
+            "studentId": 1,
+            "screen": {"$ifNull": [f"${prefix}screenTime", 0]},
+            "night": {"$ifNull": [f"${prefix}nightUsage", 0]},
+            "academicMinutes": {"$ifNull": [f"${prefix}categoryMinutes.academic", {"$sum": {"$map": {
+                "input": {"$filter": {
+                    "input": {"$ifNull": [f"${prefix}appsUsed", []]},
+                    "as": "app",
+                    "cond": {"$in": ["$$app.appName", ACADEMIC_APPS]},
+                }},
+                "as": "app",
+                "in": {"$ifNull": ["$$app.durationMinutes", 0]},
+            }}}]},
+        }},
+        {"$group": {
+            "_id": "$studentId",
+            "avgScreen": {"$avg": "$screen"},
+            "avgNight": {"$avg": "$night"},
+            "avgAcademicRatio": {"$avg": {
+                "$cond": [{"$gt": ["$screen", 0]}, {"$divide": ["$academicMinutes", "$screen"]}, 0]
+            }},
+        }},
+    ]
 
-#         # --- Save to recommendations collection ---
-#         doc = {
-#             "studentId": student_id,
-#             "averageMark": round(avg_mark, 2),
-#             "avgStudyHours": round(avg_study_hours, 2),
-#             "avgFocusLevel": round(avg_focus, 2),
-#             "avgScreenTime": round(avg_screen, 2),
-#             "avgNightUsage": round(avg_night, 2),
-#             "avgAcademicAppRatio": round(avg_academic_ratio, 2),
-#             "recommendations": recs,
-#             "generatedAt": datetime.utcnow()
-#         }
+async def unordered_bulk_write(collection, ops: list) -> tuple:
+    """Run ``ops`` unordered; return ({op index: upserted _id}, {op index: error message})."""
+    if not ops:
+        return {}, {}
+    try:
+        result = await collection.bulk_write(ops, ordered=False)
+        return result.upserted_ids, {}
+    except BulkWriteError as e:
+        upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+        failed = {err["index"]: err.get("errmsg", "write failed") for err in e.details.get("writeErrors", [])}
+        return upserted, failed
 
-#         await rec_coll.update_one({"studentId": student_id}, {"$set": doc}, upsert=True)
-#         count += 1
+class PhoneUsageStore(ABC):
+    """Storage for daily PhoneUsage records, keyed by (studentId, date at UTC midnight)."""
 
-#     return {"status": "success", "message": f"Generated recommendations for {count} students."}
+    layout = None
 
+    def __init__(self, collection):
+        self.collection = collection
 
+    @abstractmethod
+    async def write_days(self, days: list) -> list:
+        """Upsert (studentId, date, fields) records with one unordered bulk_write.
 
+        Returns one result per record, in order, whose ``status`` is
+        ``created`` or ``updated`` (daily layout), ``written`` (monthly
+        layout, where one bucket write covers several days) or ``failed``
+        with an ``error``. Callers bump the PhoneUsage versions themselves.
+        """
 
-# 
-from fastapi import HTTPException
-from datetime import datetime, timedelta, timezone
+    @abstractmethod
+    async def read_days(self, student_id: str, start: datetime, end: datetime) -> List[dict]:
+        """Return the student's day records with start <= date < end, oldest first."""
 
-@app.get("/recommendations/{studentId}", response_description="Get or generate recommendations for a student")
-async def get_or_generate_recommendation(studentId: str):
-    students_coll = app.mongodb["Students"]
-    academics_coll = app.mongodb["academics"]
-    phone_coll = app.mongodb["PhoneUsage"]
-    rec_coll = app.mongodb["recommendations"]
+    @abstractmethod
+    def iter_days(self, batch_size: int = 500):
+        """Async-iterate every stored (studentId, date, fields) record, by student then date."""
 
-    # 1️⃣ Check if student exists
-    student = await students_coll.find_one({"UserID": studentId})
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
+    @abstractmethod
+    def features_pipeline(self, window_start: datetime, student_ids: Optional[List[str]] = None) -> list:
+        """Aggregation reducing each student's days since ``window_start`` to three averages.
 
-    # 2️⃣ Fetch ONLY the latest academic record for the student
-    latest_academic = await academics_coll.find_one(
-        {"studentId": studentId},
-        sort=[("createdAt", -1)]  # Get the most recent record
+        Pass ``student_ids`` to restrict it to one student or a batch;
+        without it the whole cohort is aggregated.
+        """
+
+    async def features(self, window_start: datetime, student_ids: Optional[List[str]] = None) -> dict:
+        """Return {studentId: (avg_screen, avg_night, avg_academic_ratio)} for students with usage in the window."""
+        return {
+            row["_id"]: (row["avgScreen"], row["avgNight"], row["avgAcademicRatio"])
+            async for row in self.collection.aggregate(self.features_pipeline(window_start, student_ids))
+        }
+
+    @abstractmethod
+    def backfill_categories(self, batch_size: int = 500):
+        """Recompute categoryMinutes on days stored under other registry versions.
+
+        Async-iterates (days updated, studentIds touched) after each bulk
+        update of about ``batch_size`` days; see backfill_app_categories().
+        """
+
+class DailyPhoneUsageStore(PhoneUsageStore):
+    """PhoneUsage: one document per student per day, served by studentId_1_date_1."""
+
+    layout = "daily"
+
+    async def write_days(self, days: list) -> list:
+        ops = [
+            UpdateOne({"studentId": student_id, "date": day}, {"$set": fields}, upsert=True)
+            for student_id, day, fields in days
+        ]
+        upserted, failed = await unordered_bulk_write(self.collection, ops)
+        results = []
+        for op_index in range(len(ops)):
+            if op_index in failed:
+                results.append({"status": "failed", "error": failed[op_index]})
+            elif op_index in upserted:
+                results.append({"status": "created", "id": str(upserted[op_index])})
+            else:
+                results.append({"status": "updated"})
+        return results
+
+    async def read_days(self, student_id: str, start: datetime, end: datetime) -> List[dict]:
+        return await self.collection.find(
+            {"studentId": student_id, "date": {"$gte": start, "$lt": end}}, {"_id": 0}
+        ).sort("date", 1).to_list(length=None)
+
+    async def iter_days(self, batch_size: int = 500):
+        cursor = self.collection.find({}, {"_id": 0}).sort([("studentId", 1), ("date", 1)]).batch_size(batch_size)
+        async for doc in cursor:
+            student_id, day = doc.pop("studentId"), doc.pop("date")
+            yield student_id, day, doc
+
+    def features_pipeline(self, window_start: datetime, student_ids: Optional[List[str]] = None) -> list:
+        match = {"date": {"$gte": window_start}}
+        if student_ids is not None:
+            match["studentId"] = {"$in": student_ids}
+        return [{"$match": match}] + phone_usage_feature_stages()
+
+    async def backfill_categories(self, batch_size: int = 500):
+        cursor = self.collection.find(
+            {"categoryVersion": {"$ne": APP_CATEGORY_VERSION}},
+            {"studentId": 1, "appsUsed": 1}
+        ).batch_size(batch_size)
+        ops = []
+        student_ids = set()
+        async for day in cursor:
+            ops.append(UpdateOne({"_id": day["_id"]}, {"$set": categorize_phone_usage(day.get("appsUsed"))}))
+            student_ids.add(day.get("studentId"))
+            if len(ops) >= batch_size:
+                result = await self.collection.bulk_write(ops, ordered=False)
+                yield result.modified_count, student_ids
+                ops = []
+                student_ids = set()
+        if ops:
+            result = await self.collection.bulk_write(ops, ordered=False)
+            yield result.modified_count, student_ids
+
+def month_start(day: datetime) -> datetime:
+    """First instant of ``day``'s calendar month."""
+    return datetime(day.year, day.month, 1)
+
+class MonthlyPhoneUsageStore(PhoneUsageStore):
+    """PhoneUsageMonthly: one bucket per student per month, served by studentId_1_month_1."""
+
+    layout = "monthly"
+
+    async def write_days(self, days: list) -> list:
+        # Days landing in the same bucket share one upsert that $sets each days.DD
+        buckets = {}
+        for index, (student_id, day, _) in enumerate(days):
+            buckets.setdefault((student_id, month_start(day)), []).append(index)
+        ops = []
+        for (student_id, month), indexes in buckets.items():
+            day_fields = {f"days.{days[i][1].day:02d}": dict(days[i][2], date=days[i][1]) for i in indexes}
+            ops.append(UpdateOne(
+                {"studentId": student_id, "month": month},
+                {
+                    "$set": day_fields,
+                    # The bucket is only as current as its oldest day, so the backfill can find it
+                    "$min": {"categoryVersion": min(days[i][2].get("categoryVersion", 0) for i in indexes)},
+                },
+                upsert=True
+            ))
+        _, failed = await unordered_bulk_write(self.collection, ops)
+        results = [None] * len(days)
+        for op_index, indexes in enumerate(buckets.values()):
+            for i in indexes:
+                if op_index in failed:
+                    results[i] = {"status": "failed", "error": failed[op_index]}
+                else:
+                    results[i] = {"status": "written"}
+        return results
+
+    @staticmethod
+    def bucket_days(bucket: dict) -> List[dict]:
+        """A bucket's day records, oldest first."""
+        return [bucket["days"][key] for key in sorted(bucket.get("days") or {})]
+
+    async def read_days(self, student_id: str, start: datetime, end: datetime) -> List[dict]:
+        buckets = await self.collection.find(
+            {"studentId": student_id, "month": {"$gte": month_start(start), "$lt": end}}, {"_id": 0}
+        ).sort("month", 1).to_list(length=None)
+        return [
+            dict(day, studentId=student_id)
+            for bucket in buckets
+            for day in self.bucket_days(bucket)
+            if start <= day["date"] < end
+        ]
+
+    async def iter_days(self, batch_size: int = 500):
+        cursor = self.collection.find({}, {"_id": 0}).sort([("studentId", 1), ("month", 1)]).batch_size(batch_size)
+        async for bucket in cursor:
+            for day in self.bucket_days(bucket):
+                day = dict(day)
+                yield bucket["studentId"], day.pop("date"), day
+
+    def features_pipeline(self, window_start: datetime, student_ids: Optional[List[str]] = None) -> list:
+        match = {"month": {"$gte": month_start(window_start)}}
+        if student_ids is not None:
+            match["studentId"] = {"$in": student_ids}
+        return [
+            {"$match": match},
+            {"$project": {"studentId": 1, "day": {"$objectToArray": "$days"}}},
+            {"$unwind": "$day"},
+            {"$match": {"day.v.date": {"$gte": window_start}}},
+        ] + phone_usage_feature_stages("day.v.")
+
+    async def backfill_categories(self, batch_size: int = 500):
+        cursor = self.collection.find(
+            {"categoryVersion": {"$ne": APP_CATEGORY_VERSION}},
+            {"studentId": 1, "days": 1}
+        ).batch_size(batch_size)
+        ops = []
+        day_count = 0
+        student_ids = set()
+        async for bucket in cursor:
+            day_fields = {"categoryVersion": APP_CATEGORY_VERSION}
+            for key, day in (bucket.get("days") or {}).items():
+                for field, value in categorize_phone_usage(day.get("appsUsed")).items():
+                    day_fields[f"days.{key}.{field}"] = value
+                day_count += 1
+            ops.append(UpdateOne({"_id": bucket["_id"]}, {"$set": day_fields}))
+            student_ids.add(bucket.get("studentId"))
+            if day_count >= batch_size:
+                await self.collection.bulk_write(ops, ordered=False)
+                yield day_count, student_ids
+                ops = []
+                day_count = 0
+                student_ids = set()
+        if ops:
+            await self.collection.bulk_write(ops, ordered=False)
+            yield day_count, student_ids
+
+async def dedupe_phone_usage(db) -> int:
+    """Delete all but the newest PhoneUsage document of every duplicated (studentId, date).
+
+    Duplicates could be created by concurrent upserts before
+    studentId_1_date_1 was unique. Windows and versions of the students
+    affected are refreshed. Returns the number of documents deleted.
+    """
+    phone_coll = db["PhoneUsage"]
+    pipeline = [
+        {"$group": {"_id": {"studentId": "$studentId", "date": "$date"}, "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ]
+    extra_ids, student_ids = [], set()
+    async for group in phone_coll.aggregate(pipeline, allowDiskUse=True):
+        extra_ids.extend(sorted(group["ids"])[:-1])
+        student_ids.add(group["_id"]["studentId"])
+    if not extra_ids:
+        return 0
+    result = await phone_coll.delete_many({"_id": {"$in": extra_ids}})
+    await rebuild_usage_windows(db, student_ids)
+    await bump_phone_usage_versions(db, student_ids)
+    return result.deleted_count
+
+# Collections whose indexes were made unique after data was written, and how to
+# remove the duplicate keys first (see ensure_indexes)
+UNIQUE_INDEX_DEDUPERS = {
+    "Users": dedupe_users,
+    "PhoneUsage": dedupe_phone_usage,
+}
+
+PHONE_USAGE_STORES = {
+    "daily": (DailyPhoneUsageStore, "PhoneUsage"),
+    "monthly": (MonthlyPhoneUsageStore, "PhoneUsageMonthly"),
+}
+
+def create_phone_usage_store(db, layout: Optional[str] = None) -> PhoneUsageStore:
+    """Build the PhoneUsage store for ``layout`` (default: the PHONE_USAGE_LAYOUT setting)."""
+    layout = layout or PHONE_USAGE_LAYOUT
+    if layout not in PHONE_USAGE_STORES:
+        raise ValueError(f"Unknown PhoneUsage layout {layout!r}; expected one of {', '.join(PHONE_USAGE_STORES)}")
+    store_class, coll_name = PHONE_USAGE_STORES[layout]
+    return store_class(db[coll_name])
+
+async def migrate_phone_usage_layout(db, to_layout: str, batch_size: int = 500) -> tuple:
+    """Copy every day record from the other layout into ``to_layout``; returns (copied, failed).
+
+    Writes are upserts keyed on (studentId, date), so an interrupted
+    migration can simply be re-run. The source collection is left in place;
+    drop it once PHONE_USAGE_LAYOUT points at the new layout.
+    """
+    from_layout = "daily" if to_layout == "monthly" else "monthly"
+    source = create_phone_usage_store(db, from_layout)
+    target = create_phone_usage_store(db, to_layout)
+
+    counts = Counter()
+    batch = []
+    async for record in source.iter_days(batch_size):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            counts.update("failed" if r["status"] == "failed" else "copied" for r in await target.write_days(batch))
+            batch = []
+    if batch:
+        counts.update("failed" if r["status"] == "failed" else "copied" for r in await target.write_days(batch))
+    return counts["copied"], counts["failed"]
+
+# ==========================
+# PhoneUsage ingestion
+# ==========================
+# Devices upload usage as student-day records. Each record is upserted on
+# (studentId, date), so re-sending a batch after a dropped connection just
+# rewrites the same documents.
+PHONE_USAGE_BATCH_MAX = 1000
+
+@app.post("/phone-usage/batch", response_description="Upsert PhoneUsage records for many student-days")
+async def upload_phone_usage_batch(records: List[Any] = Body(..., embed=True)):
+    """Validate each record on its own, then write all valid ones in one unordered bulk_write.
+
+    Returns one result per input record, in order: ``created`` or
+    ``updated`` when written (``written`` under the monthly layout), ``invalid`` when the record failed validation,
+    ``unknown_student`` when no student has that UserID, ``superseded`` when
+    a later record in the same batch has the same (studentId, date), and
+    ``failed`` when the write itself was rejected.
+    """
+    if len(records) > PHONE_USAGE_BATCH_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {PHONE_USAGE_BATCH_MAX} records per batch"
+        )
+
+    results = [None] * len(records)
+    valid = {}
+    for index, raw in enumerate(records):
+        try:
+            record = PhoneUsageRecord.parse_obj(raw)
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "invalid", "errors": [
+                {"field": ".".join(str(part) for part in err["loc"]), "message": err["msg"]} for err in e.errors()
+            ]}
+            continue
+        key = (record.studentId, record.date)
+        if key in valid:
+            superseded = valid[key][0]
+            results[superseded] = {"index": superseded, "status": "superseded"}
+        valid[key] = (index, record)
+
+    student_ids = list({student_id for student_id, _ in valid})
+    known = {
+        s["UserID"] async for s in app.mongodb["Students"].find({"UserID": {"$in": student_ids}}, {"_id": 0, "UserID": 1})
+    }
+
+    days, day_indexes = [], []
+    for (student_id, day), (index, record) in valid.items():
+        if student_id not in known:
+            results[index] = {"index": index, "status": "unknown_student"}
+            continue
+        apps_used = [a.dict() for a in record.appsUsed]
+        days.append((student_id, datetime(day.year, day.month, day.day), {
+            "screenTime": record.screenTime,
+            "nightUsage": record.nightUsage,
+            "appsUsed": apps_used,
+            **categorize_phone_usage(apps_used),
+        }))
+        day_indexes.append(index)
+
+    written = await create_phone_usage_store(app.mongodb).write_days(days) if days else []
+    written_days = []
+    for day, index, result in zip(days, day_indexes, written):
+        results[index] = {"index": index, **result}
+        if result["status"] != "failed":
+            written_days.append(day)
+    await apply_usage_window_days(app.mongodb, written_days)
+    await bump_phone_usage_versions(app.mongodb, {student_id for student_id, _, _ in written_days})
+
+    summary = Counter(r["status"] for r in results)
+    return {"status": "success", "summary": dict(summary), "results": results}
+
+# ==========================
+# App session ingestion
+# ==========================
+# Devices may upload raw foreground sessions (app, start, end) instead of
+# daily totals. Uploads are appended to app_sessions with compacted=False; a
+# background compaction stage picks up uncompacted sessions, and for every
+# student-day they touch rebuilds the daily PhoneUsage document (screenTime,
+# nightUsage, appsUsed, categoryMinutes) from all of that day's sessions,
+# then marks them compacted. Sessions are split at midnight and the minutes
+# that fall between NIGHT_START_HOUR and NIGHT_END_HOUR count as night usage.
+# Rebuilding whole days keeps the stage idempotent: if it stops between the
+# PhoneUsage write and marking the sessions, the next pass writes the same
+# documents again. A session that becomes visible late is still unmarked,
+# so it is picked up whenever it appears. A student-day with sessions is
+# owned by the compaction; it replaces any daily totals uploaded for that day.
+
+def night_windows(day_start: datetime) -> list:
+    """The [start, end) spans of a calendar day that count as night usage."""
+    night_start = day_start + timedelta(hours=NIGHT_START_HOUR)
+    night_end = day_start + timedelta(hours=NIGHT_END_HOUR)
+    if NIGHT_START_HOUR > NIGHT_END_HOUR:
+        # The usual case: the window wraps midnight
+        return [(day_start, night_end), (night_start, day_start + timedelta(days=1))]
+    return [(night_start, night_end)]
+
+def overlap_seconds(start: datetime, end: datetime, window_start: datetime, window_end: datetime) -> float:
+    return max(0.0, (min(end, window_end) - max(start, window_start)).total_seconds())
+
+def summarize_app_sessions(sessions: list, day_start: datetime) -> dict:
+    """Fold the sessions overlapping one day into the daily PhoneUsage fields."""
+    day_end = day_start + timedelta(days=1)
+    windows = night_windows(day_start)
+    night_seconds = 0.0
+    app_seconds = {}
+    for session in sessions:
+        seconds = overlap_seconds(session["start"], session["end"], day_start, day_end)
+        if not seconds:
+            continue
+        night_seconds += sum(overlap_seconds(session["start"], session["end"], *window) for window in windows)
+        app_seconds[session["appName"]] = app_seconds.get(session["appName"], 0.0) + seconds
+
+    # Minutes are rounded once per app and screenTime is their sum, so appsUsed,
+    # categoryMinutes and screenTime agree; apps that round to 0 minutes are dropped
+    apps_used = [
+        {"appName": app_name, "durationMinutes": round(seconds / 60)}
+        for app_name, seconds in sorted(app_seconds.items(), key=lambda item: -item[1])
+        if round(seconds / 60)
+    ]
+    screen_time = sum(app["durationMinutes"] for app in apps_used)
+    return {
+        "screenTime": screen_time,
+        "nightUsage": min(round(night_seconds / 60), screen_time),
+        "appsUsed": apps_used,
+        **categorize_phone_usage(apps_used),
+    }
+
+def session_days(start: datetime, end: datetime) -> list:
+    """Midnights of every calendar day a session overlaps."""
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    days = []
+    while day < end:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+@app.post("/phone-usage/sessions", response_description="Append raw app foreground sessions",
+          status_code=status.HTTP_202_ACCEPTED)
+async def upload_app_sessions(sessions: List[Any] = Body(..., embed=True)):
+    """Validate and append sessions; daily PhoneUsage is updated by the compaction stage shortly after.
+
+    Times are the device's local wall clock (any UTC offset is dropped).
+    Re-sent sessions (same student, app and start) are ignored, so retries
+    are safe. Returns how many were stored, already present or rejected.
+    """
+    if len(sessions) > APP_SESSION_BATCH_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {APP_SESSION_BATCH_MAX} sessions per upload"
+        )
+
+    docs, rejected = [], []
+    max_length = timedelta(hours=APP_SESSION_MAX_HOURS)
+    for index, raw in enumerate(sessions):
+        try:
+            session = AppSession.parse_obj(raw)
+        except ValidationError as e:
+            rejected.append({"index": index, "error": "; ".join(err["msg"] for err in e.errors())})
+            continue
+        start = session.start.replace(tzinfo=None)
+        end = session.end.replace(tzinfo=None)
+        if not start < end <= start + max_length:
+            rejected.append({"index": index, "error": f"end must be after start and within {APP_SESSION_MAX_HOURS}h"})
+            continue
+        docs.append({
+            "studentId": session.studentId, "appName": session.appName, "start": start, "end": end, "compacted": False
+        })
+
+    student_ids = list({doc["studentId"] for doc in docs})
+    known = {
+        s["UserID"] async for s in app.mongodb["Students"].find({"UserID": {"$in": student_ids}}, {"_id": 0, "UserID": 1})
+    }
+    unknown = [doc for doc in docs if doc["studentId"] not in known]
+    docs = [doc for doc in docs if doc["studentId"] in known]
+
+    stored, duplicates = len(docs), 0
+    if docs:
+        try:
+            await app.mongodb["app_sessions"].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            duplicates = sum(1 for err in errors if err.get("code") == 11000)
+            if duplicates != len(errors):
+                raise HTTPException(status_code=500, detail="Some sessions could not be stored")
+            stored -= duplicates
+
+    return {
+        "status": "accepted",
+        "stored": stored,
+        "duplicates": duplicates,
+        "unknownStudents": sorted({doc["studentId"] for doc in unknown}),
+        "rejected": rejected,
+    }
+
+async def compact_app_sessions(db, batch_size: int = APP_SESSION_COMPACT_BATCH) -> int:
+    """Fold the next batch of uncompacted sessions into daily PhoneUsage; returns how many sessions were consumed."""
+    state_coll = db["compaction_state"]
+    sessions_coll = db["app_sessions"]
+    new_sessions = await sessions_coll.find(
+        {"compacted": False}, {"studentId": 1, "start": 1, "end": 1}
+    ).sort("_id", 1).limit(batch_size).to_list(length=None)
+    if not new_sessions:
+        return 0
+
+    touched = {}
+    for session in new_sessions:
+        touched.setdefault(session["studentId"], set()).update(session_days(session["start"], session["end"]))
+
+    async def rebuild_student_days(student_id: str, days: set) -> list:
+        first, last = min(days), max(days) + timedelta(days=1)
+        overlapping = await sessions_coll.find({
+            "studentId": student_id,
+            "start": {"$gte": first - timedelta(hours=APP_SESSION_MAX_HOURS), "$lt": last},
+            "end": {"$gt": first},
+        }, {"_id": 0, "appName": 1, "start": 1, "end": 1}).to_list(length=None)
+        return [(student_id, day, summarize_app_sessions(overlapping, day)) for day in sorted(days)]
+
+    rebuilt = await asyncio.gather(*(rebuild_student_days(sid, days) for sid, days in touched.items()))
+    days = [day for student_days in rebuilt for day in student_days]
+    results = await create_phone_usage_store(db).write_days(days)
+    await apply_usage_window_days(db, [day for day, result in zip(days, results) if result["status"] != "failed"])
+    await bump_phone_usage_versions(db, touched.keys())
+    failed = [r["error"] for r in results if r["status"] == "failed"]
+    if failed:
+        # Leave the sessions unmarked so the next pass retries them
+        raise RuntimeError(f"{len(failed)} PhoneUsage day writes failed: {failed[0]}")
+
+    await sessions_coll.update_many(
+        {"_id": {"$in": [session["_id"] for session in new_sessions]}}, {"$set": {"compacted": True}}
     )
+    await state_coll.update_one(
+        {"_id": "app_sessions"},
+        {"$set": {"updatedAt": datetime.utcnow()}, "$inc": {"compactedSessions": len(new_sessions)}},
+        upsert=True
+    )
+    return len(new_sessions)
+
+async def run_app_session_compaction(db) -> None:
+    """Background task: keep daily PhoneUsage up to date with the session stream."""
+    while True:
+        try:
+            consumed = await compact_app_sessions(db)
+        except Exception as e:
+            print(f"❌ App session compaction failed: {e}")
+            consumed = 0
+        # Keep going while there is a backlog; otherwise wait for new sessions
+        if consumed < APP_SESSION_COMPACT_BATCH:
+            await asyncio.sleep(APP_SESSION_COMPACT_SECONDS)
 
-    if not latest_academic:
-        raise HTTPException(status_code=404, detail="No academic data found for this student")
+# ==========================
+# Rolling usage windows
+# ==========================
+# phone_usage_windows keeps one document per student with running totals of
+# the PhoneUsage days inside the recommendation window:
+#   {studentId, windowStart, count, sums: {screen, night, academic, academicRatio},
+#    days: {"YYYY-MM-DD": {screen, night, academic, academicRatio}}, rev}
+# Writers fold each day they store into the window, and days are subtracted
+# again once they fall out of it, so reads cost one small document instead
+# of a 14-day aggregation. The per-day entries are what gets subtracted when
+# a day ages out or is re-sent. Updates are guarded by ``rev`` and retried
+# on conflict. A student with no window yet gets one built from PhoneUsage
+# the first time it is needed. Students who stop syncing are aged by the
+# nightly sweep (run_usage_window_sweep).
+USAGE_WINDOW_FIELDS = ("screen", "night", "academic", "academicRatio")
+USAGE_WINDOW_RETRIES = 5
+
+def usage_window_key(day: datetime) -> str:
+    return day.strftime("%Y-%m-%d")
+
+def usage_window_entry(day: dict) -> dict:
+    """One PhoneUsage day's contribution to the window totals (same rules as the features aggregation)."""
+    screen = day.get("screenTime") or 0
+    category_minutes = day.get("categoryMinutes") or categorize_phone_usage(day.get("appsUsed"))["categoryMinutes"]
+    academic = category_minutes.get("academic", 0)
+    return {
+        "screen": screen,
+        "night": day.get("nightUsage") or 0,
+        "academic": academic,
+        "academicRatio": academic / screen if screen > 0 else 0,
+    }
+
+def roll_usage_window(window: Optional[dict], window_start: datetime, new_days: Optional[dict] = None) -> dict:
+    """Move ``window`` forward to ``window_start`` and fold in ``new_days`` ({day key: entry}).
+
+    Days before ``window_start`` are subtracted from the sums and dropped;
+    a new day replaces (and first subtracts) any entry already stored for
+    the same date. Returns the fields to $set on the window document.
+    """
+    days = dict(window["days"]) if window else {}
+    sums = dict(window["sums"]) if window else dict.fromkeys(USAGE_WINDOW_FIELDS, 0)
+    start_key = usage_window_key(window_start)
+
+    def subtract(key):
+        entry = days.pop(key)
+        for field in USAGE_WINDOW_FIELDS:
+            sums[field] -= entry[field]
+
+    for key in [k for k in days if k < start_key]:
+        subtract(key)
+    for key, entry in (new_days or {}).items():
+        if key < start_key:
+            continue
+        if key in days:
+            subtract(key)
+        days[key] = entry
+        for field in USAGE_WINDOW_FIELDS:
+            sums[field] += entry[field]
+    if not days:
+        # Start the next run of additions from exact zeros rather than float residue
+        sums = dict.fromkeys(USAGE_WINDOW_FIELDS, 0)
+    return {"windowStart": window_start, "days": days, "sums": sums, "count": len(days)}
+
+def usage_window_features(window: dict, window_start: datetime) -> tuple:
+    """(avg_screen, avg_night, avg_academic_ratio) of a window, aged to ``window_start`` if it is behind."""
+    if window["windowStart"] < window_start:
+        window = roll_usage_window(window, window_start)
+    if not window["count"]:
+        return NO_PHONE_USAGE
+    sums, count = window["sums"], window["count"]
+    return sums["screen"] / count, sums["night"] / count, sums["academicRatio"] / count
+
+async def rebuild_usage_windows(db, student_ids) -> dict:
+    """Recompute the current window of each student from PhoneUsage; returns {studentId: window}.
+
+    Each write is conditioned on the rev read before PhoneUsage, so a day
+    folded in concurrently makes the write miss and the student is rebuilt
+    again. Students whose existing window disagreed with PhoneUsage (it was
+    written outside the server) get their usage version bumped.
+    """
+    pending = list(dict.fromkeys(student_ids))
+    window_start = recommendation_window_start()
+    store = create_phone_usage_store(db)
+    windows_coll = db["phone_usage_windows"]
+
+    async def rebuild(student_id: str) -> Optional[tuple]:
+        current = await windows_coll.find_one({"studentId": student_id})
+        days = await store.read_days(student_id, window_start, datetime.max)
+        window = roll_usage_window(None, window_start, {usage_window_key(d["date"]): usage_window_entry(d) for d in days})
+        update = {"$set": dict(window, updatedAt=datetime.utcnow()), "$inc": {"rev": 1}}
+        if current is None:
+            try:
+                # Never matches a stored window, so a concurrent create surfaces as a duplicate key
+                await windows_coll.update_one({"studentId": student_id, "rev": {"$exists": False}}, update, upsert=True)
+            except DuplicateKeyError:
+                return None
+        else:
+            result = await windows_coll.update_one({"_id": current["_id"], "rev": current["rev"]}, update)
+            if not result.matched_count:
+                return None
+        differs = current is not None and roll_usage_window(current, window_start)["days"] != window["days"]
+        return window, differs
+
+    windows = {}
+    changed = set()
+    for _ in range(USAGE_WINDOW_RETRIES):
+        if not pending:
+            break
+        results = await asyncio.gather(*(rebuild(sid) for sid in pending))
+        for student_id, result in zip(pending, results):
+            if result is not None:
+                windows[student_id], differs = result
+                if differs:
+                    changed.add(student_id)
+        pending = [sid for sid, result in zip(pending, results) if result is None]
+    if pending:
+        print(f"⚠️ PhoneUsage windows kept changing during rebuild: {pending[:5]}")
+    await bump_phone_usage_versions(db, changed)
+    return windows
+
+async def apply_usage_window_days(db, days: list) -> None:
+    """Fold (studentId, date, fields) days that were just written to PhoneUsage into the windows.
+
+    Called by every PhoneUsage writer after its write and before
+    bump_phone_usage_versions(). Students without a window, or whose
+    window kept changing underneath the update, are rebuilt instead.
+    """
+    window_start = recommendation_window_start()
+    new_days = {}
+    for student_id, day, fields in days:
+        if day >= window_start:
+            new_days.setdefault(student_id, {})[usage_window_key(day)] = usage_window_entry(fields)
+    if not new_days:
+        return
+
+    windows_coll = db["phone_usage_windows"]
+    windows = {w["studentId"]: w async for w in windows_coll.find({"studentId": {"$in": list(new_days)}})}
+
+    async def apply(student_id: str, entries: dict) -> bool:
+        window = windows.get(student_id)
+        for _ in range(USAGE_WINDOW_RETRIES):
+            if window is None:
+                return False
+            result = await windows_coll.update_one(
+                {"_id": window["_id"], "rev": window["rev"]},
+                {"$set": dict(roll_usage_window(window, window_start, entries), updatedAt=datetime.utcnow()),
+                 "$inc": {"rev": 1}}
+            )
+            if result.matched_count:
+                return True
+            window = await windows_coll.find_one({"studentId": student_id})
+        return False
+
+    applied = await asyncio.gather(*(apply(sid, entries) for sid, entries in new_days.items()))
+    # PhoneUsage already holds the new days, so a rebuild picks them up
+    await rebuild_usage_windows(db, [sid for sid, ok in zip(new_days, applied) if not ok])
+
+async def age_usage_windows(db, batch_size: int = USAGE_WINDOW_SWEEP_BATCH) -> int:
+    """Move every window that is behind the current window start forward; returns how many were aged."""
+    window_start = recommendation_window_start()
+    windows_coll = db["phone_usage_windows"]
+    cursor = windows_coll.find({"windowStart": {"$lt": window_start}}).batch_size(batch_size)
+
+    aged = 0
+    ops = []
+    now = datetime.utcnow()
+    async for window in cursor:
+        # A window a writer rolls in the meantime no longer matches its rev and is already aged
+        ops.append(UpdateOne(
+            {"_id": window["_id"], "rev": window["rev"]},
+            {"$set": dict(roll_usage_window(window, window_start), updatedAt=now), "$inc": {"rev": 1}}
+        ))
+        if len(ops) >= batch_size:
+            aged += (await windows_coll.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        aged += (await windows_coll.bulk_write(ops, ordered=False)).modified_count
+    return aged
+
+async def run_usage_window_sweep(db) -> None:
+    """Background task: age the windows on startup and then just after every UTC midnight."""
+    while True:
+        try:
+            aged = await age_usage_windows(db)
+            if aged:
+                print(f"✅ Aged {aged} PhoneUsage windows to {recommendation_window_start().date()}")
+        except Exception as e:
+            print(f"❌ PhoneUsage window sweep failed: {e}")
+        now = datetime.utcnow()
+        next_midnight = datetime(now.year, now.month, now.day) + timedelta(days=1)
+        await asyncio.sleep((next_midnight - now).total_seconds() + 60)
+
+@app.get("/phone-usage/{studentId}/window", response_description="Rolling PhoneUsage totals for a student")
+async def get_phone_usage_window(studentId: str):
+    """Sums, day count and averages of the student's PhoneUsage over the recommendation window."""
+    window_start = recommendation_window_start()
+    window = await app.mongodb["phone_usage_windows"].find_one({"studentId": studentId})
+    if window is None:
+        if not await app.mongodb["Students"].find_one({"UserID": studentId}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Student not found")
+        window = (await rebuild_usage_windows(app.mongodb, [studentId])).get(studentId)
+        if window is None:
+            # Lost every race to concurrent writers, who have created it by now
+            window = await app.mongodb["phone_usage_windows"].find_one({"studentId": studentId})
+    if window["windowStart"] < window_start:
+        window = roll_usage_window(window, window_start)
+
+    count = window["count"]
+    sums = window["sums"]
+    return MongoJSONResponse({
+        "studentId": studentId,
+        "windowStart": window_start,
+        "days": count,
+        "totals": {"screenTime": sums["screen"], "nightUsage": sums["night"], "academicMinutes": sums["academic"]},
+        "averages": {
+            "screenTime": sums["screen"] / count if count else 0,
+            "nightUsage": sums["night"] / count if count else 0,
+            "academicMinutes": sums["academic"] / count if count else 0,
+            "academicRatio": sums["academicRatio"] / count if count else 0,
+        },
+    })
+
+# ==========================
+# Recommendations
+# ==========================
+RECOMMENDATION_WINDOW_DAYS = 14
+
+async def bump_phone_usage_versions(db, student_ids) -> None:
+    """Record that PhoneUsage changed for these students.
+
+    Every PhoneUsage writer calls this after its write, so a cached
+    recommendation built from the previous data no longer matches.
+    """
+    student_ids = set(student_ids)
+    if not student_ids:
+        return
+    await db["phone_usage_versions"].bulk_write([
+        UpdateOne({"studentId": sid}, {"$inc": {"version": 1}}, upsert=True) for sid in student_ids
+    ], ordered=False)
+
+def recommendation_fingerprint(latest_academic_id, window_start: datetime, usage_version: int) -> dict:
+    """Identify the inputs a recommendation was generated from."""
+    return {
+        "academicId": latest_academic_id,
+        "phoneUsageWindowStart": window_start,
+        "phoneUsageVersion": usage_version,
+    }
 
-    # Use only the latest academic data
+# Features for a student who has no PhoneUsage in the window
+NO_PHONE_USAGE = (0, 0, 0)
+
+async def fetch_phone_usage_features(db, window_start: datetime, student_ids: Optional[List[str]] = None) -> dict:
+    """Return {studentId: (avg_screen, avg_night, avg_academic_ratio)} for students with usage in the window.
+
+    Read from the students' rolling windows. Students without one get it
+    built on the spot; a window that already starts after ``window_start``
+    (a job that began before midnight) falls back to the PhoneUsage
+    aggregation, as does a call without ``student_ids``.
+    """
+    store = create_phone_usage_store(db)
+    if student_ids is None:
+        return await store.features(window_start)
+
+    windows = {
+        w["studentId"]: w async for w in db["phone_usage_windows"].find({"studentId": {"$in": student_ids}})
+    }
+    features = {}
+    missing, too_new = [], []
+    for student_id in student_ids:
+        window = windows.get(student_id)
+        if window is None:
+            missing.append(student_id)
+        elif window["windowStart"] > window_start:
+            too_new.append(student_id)
+        elif window["count"]:
+            features[student_id] = usage_window_features(window, window_start)
+
+    if window_start == recommendation_window_start():
+        rebuilt = await rebuild_usage_windows(db, missing)
+        features.update((sid, usage_window_features(w, window_start)) for sid, w in rebuilt.items() if w["count"])
+        too_new += [sid for sid in missing if sid not in rebuilt]
+    else:
+        too_new += missing
+    if too_new:
+        features.update(await store.features(window_start, too_new))
+    return features
+
+def parse_academic_inputs(latest_academic: dict) -> tuple:
+    """Return (current_mark, current_study_hours, current_focus) from an academics record."""
     current_mark = latest_academic.get("overallMark", 0)
-    
+
     # Handle potential empty string values for study hours and focus level
     study_hours_str = latest_academic.get("studyHours", "0")
     focus_level_str = latest_academic.get("focusLevel", "0")
-    
+
     # Convert to float with proper error handling
     try:
         current_study_hours = float(study_hours_str) if study_hours_str else 0.0
     except (ValueError, TypeError):
         current_study_hours = 0.0
-        
+
     try:
         current_focus = float(focus_level_str) if focus_level_str else 0.0
     except (ValueError, TypeError):
         current_focus = 0.0
 
-    # 3️⃣ Fetch last 14 days of phone usage
-    today = datetime.utcnow().date()
-    start_date = today - timedelta(days=14)
+    return current_mark, current_study_hours, current_focus
 
-    phone_cursor = phone_coll.find({
-        "studentId": studentId,
-        "date": {"$gte": datetime(start_date.year, start_date.month, start_date.day)}
-    })
+def summarize_phone_usage(phone_days: list) -> tuple:
+    """Return (avg_screen, avg_night, avg_academic_ratio) over PhoneUsage days already in memory.
 
+    Reference implementation of the features aggregation and of the rolling
+    windows, which the routes use so that only the averages leave the database.
+    """
     total_screen = 0
     total_night = 0
     total_academic_ratio = 0
-    phone_days = 0
 
-    async for day in phone_cursor:
+    for day in phone_days:
         screen = day.get("screenTime", 0)
         night = day.get("nightUsage", 0)
-        apps = day.get("appsUsed", [])
-        academic_minutes = sum(
-            a.get("durationMinutes", 0) for a in apps
-            if a.get("appName") in ["Google Classroom","Zoom","Docs","Google Meet","Khan Academy","Coursera"]
-        )
+        category_minutes = day.get("categoryMinutes") or categorize_phone_usage(day.get("appsUsed"))["categoryMinutes"]
+        academic_minutes = category_minutes.get("academic", 0)
         academic_ratio = academic_minutes / screen if screen > 0 else 0
 
         total_screen += screen
         total_night += night
         total_academic_ratio += academic_ratio
-        phone_days += 1
 
-    if phone_days == 0:
-        avg_screen = 0
-        avg_night = 0
-        avg_academic_ratio = 0
-    else:
-        avg_screen = total_screen / phone_days
-        avg_night = total_night / phone_days
-        avg_academic_ratio = total_academic_ratio / phone_days
+    if not phone_days:
+        return NO_PHONE_USAGE
+    return total_screen / len(phone_days), total_night / len(phone_days), total_academic_ratio / len(phone_days)
 
-    # 4️⃣ Generate ONE main recommendation with specific action steps
-    # Determine the most critical issue to focus on
-    
-    main_title = ""
-    main_description = ""
-    main_reason = ""
-    action_steps = []
-    
+# Ordered by priority: the first rule whose condition holds becomes the
+# student's main recommendation. A condition is (metric, comparison,
+# threshold); the final rule has none and always applies. Reasons are
+# format strings over the metrics passed to render_recommendation().
+RECOMMENDATION_RULES = [
     # Priority 1: Academic Performance (most critical)
-    if current_mark < 50:
-        main_title = "Urgent Academic Improvement Needed"
-        main_description = "Your current academic performance shows significant room for improvement. Focus on strengthening your study foundation and building consistent learning habits."
-        main_reason = f"Your current average mark is {current_mark:.1f}%, which is below the recommended threshold. Immediate action will help you get back on track."
-        action_steps = [
+    {
+        "when": ("current_mark", "<", 50),
+        "title": "Urgent Academic Improvement Needed",
+        "description": "Your current academic performance shows significant room for improvement. Focus on strengthening your study foundation and building consistent learning habits.",
+        "reason": "Your current average mark is {current_mark:.1f}%, which is below the recommended threshold. Immediate action will help you get back on track.",
+        "actionable_steps": [
             "Schedule 3-4 hours of focused daily study time",
             "Identify and prioritize your 2 weakest subjects",
             "Create a weekly study timetable with specific goals",
             "Seek help from teachers or tutors for difficult topics",
             "Practice past papers and mock tests regularly"
-        ]
-    elif current_mark < 70:
-        main_title = "Boost Your Academic Performance"
-        main_description = "You're making good progress, but there's potential to achieve even better results with some focused improvements to your study strategy."
-        main_reason = f"Your current average mark is {current_mark:.1f}%. With targeted effort, you can reach the next performance level."
-        action_steps = [
+        ],
+    },
+    {
+        "when": ("current_mark", "<", 70),
+        "title": "Boost Your Academic Performance",
+        "description": "You're making good progress, but there's potential to achieve even better results with some focused improvements to your study strategy.",
+        "reason": "Your current average mark is {current_mark:.1f}%. With targeted effort, you can reach the next performance level.",
+        "actionable_steps": [
             "Increase daily study time to 2-3 hours",
             "Use active recall techniques instead of passive reading",
             "Form study groups for challenging subjects",
             "Review and revise topics weekly",
             "Set specific grade targets for each subject"
-        ]
+        ],
+    },
     # Priority 2: Focus and Study Habits
-    elif current_focus < 5:
-        main_title = "Enhance Your Focus and Concentration"
-        main_description = "Your study focus needs improvement to maximize learning efficiency. Better concentration will help you absorb more information in less time."
-        main_reason = f"Your current focus level is {current_focus:.1f}/10, which may be limiting your academic potential."
-        action_steps = [
+    {
+        "when": ("current_focus", "<", 5),
+        "title": "Enhance Your Focus and Concentration",
+        "description": "Your study focus needs improvement to maximize learning efficiency. Better concentration will help you absorb more information in less time.",
+        "reason": "Your current focus level is {current_focus:.1f}/10, which may be limiting your academic potential.",
+        "actionable_steps": [
             "Create a distraction-free study environment",
             "Use the Pomodoro technique (25 min study + 5 min break)",
             "Keep your phone in another room during study time",
             "Practice mindfulness or meditation for 10 minutes daily",
             "Take regular breaks to maintain mental freshness"
-        ]
+        ],
+    },
     # Priority 3: Study Time Management
-    elif current_study_hours < 2:
-        main_title = "Increase Your Daily Study Time"
-        main_description = "Consistent daily study habits are key to academic success. Building a regular study routine will improve your learning outcomes significantly."
-        main_reason = f"You're currently studying {current_study_hours:.1f} hours daily, which may not be sufficient for optimal performance."
-        action_steps = [
+    {
+        "when": ("current_study_hours", "<", 2),
+        "title": "Increase Your Daily Study Time",
+        "description": "Consistent daily study habits are key to academic success. Building a regular study routine will improve your learning outcomes significantly.",
+        "reason": "You're currently studying {current_study_hours:.1f} hours daily, which may not be sufficient for optimal performance.",
+        "actionable_steps": [
             "Gradually increase study time to 2-3 hours daily",
             "Create a fixed daily study schedule",
             "Break study sessions into manageable chunks",
             "Track your daily study hours to build consistency",
             "Reward yourself for meeting daily study goals"
-        ]
-    # Priority 4: Digital Wellness (Screen Time)
-    elif avg_screen > 360:  # More than 6 hours
-        main_title = "Optimize Your Digital Wellness"
-        main_description = "High screen time may be affecting your sleep quality, focus, and overall well-being. Creating a healthier relationship with technology will boost your academic performance."
-        main_reason = f"You're spending {avg_screen/60:.1f} hours daily on your phone, which can impact concentration and sleep."
-        action_steps = [
+        ],
+    },
+    # Priority 4: Digital Wellness (Screen Time), more than 6 hours
+    {
+        "when": ("avg_screen", ">", 360),
+        "title": "Optimize Your Digital Wellness",
+        "description": "High screen time may be affecting your sleep quality, focus, and overall well-being. Creating a healthier relationship with technology will boost your academic performance.",
+        "reason": "You're spending {avg_screen_hours:.1f} hours daily on your phone, which can impact concentration and sleep.",
+        "actionable_steps": [
             "Set a daily screen time limit of 4-5 hours maximum",
             "Use app timers to control social media usage",
             "Replace phone time with physical activities",
             "Keep phones away during study and sleep time",
             "Find offline hobbies like reading or sports"
-        ]
-    # Priority 5: Sleep Optimization
-    elif avg_night > 120:  # More than 2 hours night usage
-        main_title = "Improve Your Sleep Quality"
-        main_description = "Late-night phone usage is disrupting your sleep patterns, which directly affects your memory consolidation and next-day focus for studying."
-        main_reason = f"You're using your phone {avg_night:.0f} minutes nightly, which can harm sleep quality and academic performance."
-        action_steps = [
+        ],
+    },
+    # Priority 5: Sleep Optimization, more than 2 hours night usage
+    {
+        "when": ("avg_night", ">", 120),
+        "title": "Improve Your Sleep Quality",
+        "description": "Late-night phone usage is disrupting your sleep patterns, which directly affects your memory consolidation and next-day focus for studying.",
+        "reason": "You're using your phone {avg_night:.0f} minutes nightly, which can harm sleep quality and academic performance.",
+        "actionable_steps": [
             "Stop phone usage 1 hour before bedtime",
             "Create a relaxing bedtime routine",
             "Aim for 7-8 hours of quality sleep nightly",
             "Keep your phone outside the bedroom",
             "Use a physical alarm clock instead of phone"
-        ]
+        ],
+    },
     # Priority 6: Academic App Usage
-    elif avg_academic_ratio < 0.3:
-        main_title = "Leverage Technology for Learning"
-        main_description = "Make your screen time more productive by using educational apps and resources that can enhance your academic performance."
-        main_reason = f"Only {avg_academic_ratio*100:.1f}% of your phone time is spent on educational content. Increasing this can boost learning."
-        action_steps = [
+    {
+        "when": ("avg_academic_ratio", "<", 0.3),
+        "title": "Leverage Technology for Learning",
+        "description": "Make your screen time more productive by using educational apps and resources that can enhance your academic performance.",
+        "reason": "Only {avg_academic_percent:.1f}% of your phone time is spent on educational content. Increasing this can boost learning.",
+        "actionable_steps": [
             "Download educational apps for your subjects",
             "Watch educational YouTube channels daily",
             "Use online study platforms like Khan Academy",
             "Join virtual study groups and online classes",
             "Replace entertainment apps with learning tools"
-        ]
-    else:
-        # Excellent performance - maintain and optimize
-        main_title = "Maintain Your Excellent Progress"
-        main_description = "You're doing great! Continue with your current approach while exploring ways to enhance your learning experience even further."
-        main_reason = f"Your current performance metrics are excellent. Focus on maintaining consistency and exploring advanced learning techniques."
-        action_steps = [
+        ],
+    },
+    # Excellent performance - maintain and optimize
+    {
+        "when": None,
+        "title": "Maintain Your Excellent Progress",
+        "description": "You're doing great! Continue with your current approach while exploring ways to enhance your learning experience even further.",
+        "reason": "Your current performance metrics are excellent. Focus on maintaining consistency and exploring advanced learning techniques.",
+        "actionable_steps": [
             "Continue your current study routine",
             "Explore advanced learning techniques",
             "Help other students to reinforce your knowledge",
             "Set challenging academic goals for yourself",
             "Maintain a healthy work-life balance"
-        ]
-    
-    main_recommendation = {
-        "title": main_title,
-        "description": main_description,
-        "reason": main_reason,
-        "actionable_steps": action_steps
+        ],
+    },
+]
+
+# Extra tips (static for now)
+EXTRA_TIPS = [
+    {"title": "Morning Brain Boost", "tip": "Start your day with breakfast and 10 minutes light exercise", "icon": "breakfast_dining"},
+    {"title": "Pomodoro Study", "tip": "25 min study + 5 min break", "icon": "timer"},
+    {"title": "Stress Relief", "tip": "5 deep breaths or 2 min walk when stressed", "icon": "spa"},
+    {"title": "Hydration Reminder", "tip": "Keep a water bottle at your desk", "icon": "local_drink"},
+    {"title": "Social Learning", "tip": "Explain concepts to peers weekly", "icon": "group"}
+]
+
+def pick_recommendation_rule(metrics: dict) -> int:
+    """Return the index of the first rule in RECOMMENDATION_RULES that applies."""
+    for index, rule in enumerate(RECOMMENDATION_RULES):
+        if rule["when"] is None:
+            return index
+        metric, comparison, threshold = rule["when"]
+        value = metrics[metric]
+        if (value < threshold) if comparison == "<" else (value > threshold):
+            return index
+
+def render_recommendation(studentId: str, metrics: dict, rule_index: int, fingerprint: dict) -> dict:
+    """Build the stored recommendation document for one student from their metrics and chosen rule."""
+    rule = RECOMMENDATION_RULES[rule_index]
+    reason = rule["reason"].format(
+        avg_screen_hours=metrics["avg_screen"] / 60,
+        avg_academic_percent=metrics["avg_academic_ratio"] * 100,
+        **metrics
+    )
+    return {
+        "studentId": studentId,
+        "currentMark": round(metrics["current_mark"], 2),
+        "currentStudyHours": round(metrics["current_study_hours"], 2),
+        "currentFocusLevel": round(metrics["current_focus"], 2),
+        "avgScreenTime": round(metrics["avg_screen"], 2),
+        "avgNightUsage": round(metrics["avg_night"], 2),
+        "avgAcademicAppRatio": round(metrics["avg_academic_ratio"], 2),
+        "main_recommendation": {
+            "title": rule["title"],
+            "description": rule["description"],
+            "reason": reason,
+            "actionable_steps": list(rule["actionable_steps"])
+        },
+        "extra_tips": [dict(tip) for tip in EXTRA_TIPS],
+        "inputFingerprint": fingerprint,
+        "generatedAt": datetime.utcnow()
+    }
+
+# The metrics rule conditions and reasons refer to: parse_academic_inputs() followed by the usage features
+RECOMMENDATION_METRICS = (
+    "current_mark", "current_study_hours", "current_focus", "avg_screen", "avg_night", "avg_academic_ratio",
+)
+
+def recommendation_metrics(latest_academic: dict, usage_features: tuple) -> dict:
+    """The values the rule conditions and reasons refer to, keyed by metric name."""
+    return dict(zip(RECOMMENDATION_METRICS, parse_academic_inputs(latest_academic) + tuple(usage_features)))
+
+def build_recommendation(studentId: str, latest_academic: dict, usage_features: tuple, fingerprint: dict) -> dict:
+    """Run the rule cascade for one student and return the recommendation document to store.
+
+    ``usage_features`` is (avg_screen, avg_night, avg_academic_ratio), as
+    returned by fetch_phone_usage_features().
+    """
+    metrics = recommendation_metrics(latest_academic, usage_features)
+    return render_recommendation(studentId, metrics, pick_recommendation_rule(metrics), fingerprint)
+
+def is_plain_number(value) -> bool:
+    return isinstance(value, (int, float))
+
+def load_cohort_usage(cohort_metrics: list) -> dict:
+    """Unpack a cohort's recommendation_metrics() dicts into one float64 array per metric.
+
+    Values that are not plain numbers (e.g. an overallMark stored as a
+    string or Decimal128) become NaN; build_recommendations_vectorized()
+    scores those students one by one instead.
+    """
+    return {
+        metric: np.array(
+            [m[metric] if is_plain_number(m[metric]) else np.nan for m in cohort_metrics], dtype=np.float64
+        )
+        for metric in RECOMMENDATION_METRICS
     }
 
-    # 5️⃣ Extra tips (static for now)
-    extra_tips = [
-        {"title": "Morning Brain Boost", "tip": "Start your day with breakfast and 10 minutes light exercise", "icon": "breakfast_dining"},
-        {"title": "Pomodoro Study", "tip": "25 min study + 5 min break", "icon": "timer"},
-        {"title": "Stress Relief", "tip": "5 deep breaths or 2 min walk when stressed", "icon": "spa"},
-        {"title": "Hydration Reminder", "tip": "Keep a water bottle at your desk", "icon": "local_drink"},
-        {"title": "Social Learning", "tip": "Explain concepts to peers weekly", "icon": "group"}
+def score_cohort_usage(metrics: dict) -> np.ndarray:
+    """Pick every student's rule at once: one boolean mask per rule, first match wins via np.select."""
+    conditions = []
+    for rule in RECOMMENDATION_RULES[:-1]:
+        metric, comparison, threshold = rule["when"]
+        conditions.append(metrics[metric] < threshold if comparison == "<" else metrics[metric] > threshold)
+    return np.select(conditions, np.arange(len(conditions)), default=len(RECOMMENDATION_RULES) - 1)
+
+def build_recommendations_vectorized(students: list) -> list:
+    """Score a cohort at once; the array counterpart of build_recommendation().
+
+    ``students`` is a list of (studentId, latest_academic, usage_features,
+    fingerprint) tuples, the same arguments build_recommendation() takes,
+    and the documents are identical to what it returns.
+    """
+    if not students:
+        return []
+    cohort_metrics = [recommendation_metrics(latest_academic, usage_features)
+                      for _, latest_academic, usage_features, _ in students]
+    rule_indexes = score_cohort_usage(load_cohort_usage(cohort_metrics)).tolist()
+
+    docs = []
+    for (student_id, _, _, fingerprint), metrics, rule_index in zip(students, cohort_metrics, rule_indexes):
+        if not all(is_plain_number(value) for value in metrics.values()):
+            # NaN placeholders in the arrays: let the scalar cascade decide (and fail) exactly as it would
+            rule_index = pick_recommendation_rule(metrics)
+        docs.append(render_recommendation(student_id, metrics, rule_index, fingerprint))
+    return docs
+
+def recommendation_window_start() -> datetime:
+    """First day (UTC midnight) of the PhoneUsage window recommendations are built from."""
+    start_date = datetime.utcnow().date() - timedelta(days=RECOMMENDATION_WINDOW_DAYS)
+    return datetime(start_date.year, start_date.month, start_date.day)
+
+@app.get("/recommendations/{studentId}", response_description="Get or generate recommendations for a student")
+async def get_or_generate_recommendation(studentId: str):
+    students_coll = app.mongodb["Students"]
+    academics_coll = app.mongodb["academics"]
+    rec_coll = app.mongodb["recommendations"]
+
+    # 1️⃣ Fetch the student, their latest academic record, the PhoneUsage
+    # version and the stored recommendation in parallel. The version is read
+    # before any PhoneUsage, so a write that lands mid-computation only ever
+    # causes one extra recompute, never a stale cache hit.
+    student, latest_academic, usage_version, cached = await asyncio.gather(
+        students_coll.find_one({"UserID": studentId}, {"_id": 1}),
+        academics_coll.find_one({"studentId": studentId}, sort=[("createdAt", -1)]),
+        app.mongodb["phone_usage_versions"].find_one({"studentId": studentId}, {"version": 1}),
+        rec_coll.find_one({"studentId": studentId}),
+    )
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    if not latest_academic:
+        raise HTTPException(status_code=404, detail="No academic data found for this student")
+
+    # 2️⃣ Serve the stored recommendation while its inputs are unchanged
+    window_start = recommendation_window_start()
+    fingerprint = recommendation_fingerprint(
+        latest_academic["_id"], window_start, usage_version["version"] if usage_version else 0
+    )
+    if cached and cached.get("inputFingerprint") == fingerprint:
+        return MongoJSONResponse(cached)
+
+    # 3️⃣ Read the student's rolling 14-day usage totals and run the rule cascade
+    features = await fetch_phone_usage_features(app.mongodb, window_start, [studentId])
+    doc = build_recommendation(studentId, latest_academic, features.get(studentId, NO_PHONE_USAGE), fingerprint)
+
+    # 4️⃣ Save or update recommendation in MongoDB
+    saved_doc = await rec_coll.find_one_and_update(
+        {"studentId": studentId}, {"$set": doc}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+
+    return MongoJSONResponse(saved_doc)
+
+# ==========================
+# Cohort recommendation job
+# ==========================
+# Recomputes every student's recommendation in keyset order of UserID. Each
+# batch prefetches its inputs with three bulk reads and writes all of its
+# results in one unordered bulk_write of upserts; up to
+# RECOMMENDATION_JOB_CONCURRENCY batches run at once. Progress is recorded
+# in recommendation_jobs after every round, and an unfinished job resumes
+# from its last recorded UserID.
+
+async def prefetch_recommendation_inputs(db, student_ids: List[str], window_start: datetime) -> tuple:
+    """Fetch latest academics, PhoneUsage features and usage versions for a batch of students."""
+    latest_pipeline = [
+        {"$match": {"studentId": {"$in": student_ids}}},
+        {"$sort": {"studentId": 1, "createdAt": -1}},
+        {"$group": {"_id": "$studentId", "latest": {"$first": "$$ROOT"}}},
     ]
+    academics_cursor = db["academics"].aggregate(latest_pipeline)
+    versions_cursor = db["phone_usage_versions"].find({"studentId": {"$in": student_ids}}, {"studentId": 1, "version": 1})
 
-    # 6️⃣ Save or update recommendation in MongoDB
-    doc = {
-        "studentId": studentId,
-        "currentMark": round(current_mark, 2),
-        "currentStudyHours": round(current_study_hours, 2),
-        "currentFocusLevel": round(current_focus, 2),
-        "avgScreenTime": round(avg_screen, 2),
-        "avgNightUsage": round(avg_night, 2),
-        "avgAcademicAppRatio": round(avg_academic_ratio, 2),
-        "main_recommendation": main_recommendation,
-        "extra_tips": extra_tips,
-        "generatedAt": datetime.utcnow()
+    academics_rows, features, version_rows = await asyncio.gather(
+        academics_cursor.to_list(length=None),
+        fetch_phone_usage_features(db, window_start, student_ids),
+        versions_cursor.to_list(length=None),
+    )
+    latest_academics = {row["_id"]: row["latest"] for row in academics_rows}
+    versions = {row["studentId"]: row.get("version", 0) for row in version_rows}
+    return latest_academics, features, versions
+
+async def generate_recommendations_batch(db, student_ids: List[str], window_start: datetime) -> int:
+    """Recompute recommendations for one batch of students; returns how many were written."""
+    latest_academics, features, versions = await prefetch_recommendation_inputs(db, student_ids, window_start)
+    ops = []
+    for student_id in student_ids:
+        latest_academic = latest_academics.get(student_id)
+        if not latest_academic:
+            continue  # nothing to base a recommendation on yet
+        fingerprint = recommendation_fingerprint(latest_academic["_id"], window_start, versions.get(student_id, 0))
+        doc = build_recommendation(student_id, latest_academic, features.get(student_id, NO_PHONE_USAGE), fingerprint)
+        ops.append(UpdateOne({"studentId": student_id}, {"$set": doc}, upsert=True))
+    if ops:
+        await db["recommendations"].bulk_write(ops, ordered=False)
+    return len(ops)
+
+async def open_recommendation_job(db, restart: bool = False) -> dict:
+    """Return the unfinished job to resume, or record a new one."""
+    jobs_coll = db["recommendation_jobs"]
+    if not restart:
+        job = await jobs_coll.find_one({"status": {"$ne": "completed"}}, sort=[("startedAt", -1)])
+        if job:
+            await jobs_coll.update_one({"_id": job["_id"]}, {"$set": {"status": "running", "resumedAt": datetime.utcnow()}})
+            job["status"] = "running"
+            return job
+
+    # Supersede any unfinished job so it is not picked up again later
+    await jobs_coll.update_many({"status": {"$ne": "completed"}}, {"$set": {"status": "abandoned"}})
+    job = {
+        "_id": ObjectId(),
+        "status": "running",
+        "startedAt": datetime.utcnow(),
+        "total": await db["Students"].count_documents({"UserID": {"$nin": [None, ""]}}),
+        "processed": 0,
+        "generated": 0,
+        "lastStudentId": None,
     }
+    await jobs_coll.insert_one(job)
+    return job
 
-    await rec_coll.update_one({"studentId": studentId}, {"$set": doc}, upsert=True)
+async def run_recommendation_job(db, job: dict, batch_size: int = RECOMMENDATION_JOB_BATCH_SIZE,
+                                 concurrency: int = RECOMMENDATION_JOB_CONCURRENCY,
+                                 on_progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """Work through the cohort from the job's checkpoint, recording progress as it goes."""
+    jobs_coll = db["recommendation_jobs"]
+    students_coll = db["Students"]
+    window_start = recommendation_window_start()
 
-    # Fetch the inserted/updated document
-    saved_doc = await rec_coll.find_one({"studentId": studentId})
-    saved_doc["_id"] = str(saved_doc["_id"])
+    try:
+        while True:
+            query = {"UserID": {"$gt": job["lastStudentId"]}} if job["lastStudentId"] else {"UserID": {"$nin": [None, ""]}}
+            cursor = students_coll.find(query, {"_id": 0, "UserID": 1}).sort("UserID", 1).limit(batch_size * concurrency)
+            student_ids = list(dict.fromkeys([student["UserID"] async for student in cursor]))
+            if not student_ids:
+                break
+
+            batches = [student_ids[i:i + batch_size] for i in range(0, len(student_ids), batch_size)]
+            written = await asyncio.gather(*(generate_recommendations_batch(db, batch, window_start) for batch in batches))
+
+            job["processed"] += len(student_ids)
+            job["generated"] += sum(written)
+            job["lastStudentId"] = student_ids[-1]
+            await jobs_coll.update_one({"_id": job["_id"]}, {"$set": {
+                "processed": job["processed"],
+                "generated": job["generated"],
+                "lastStudentId": job["lastStudentId"],
+                "updatedAt": datetime.utcnow(),
+            }})
+            if on_progress:
+                on_progress(job)
+
+        job["status"] = "completed"
+        await jobs_coll.update_one({"_id": job["_id"]}, {"$set": {"status": "completed", "finishedAt": datetime.utcnow()}})
+        return job
+    except asyncio.CancelledError:
+        await jobs_coll.update_one({"_id": job["_id"]}, {"$set": {"status": "interrupted"}})
+        raise
+    except Exception as e:
+        await jobs_coll.update_one({"_id": job["_id"]}, {"$set": {"status": "failed", "error": str(e)}})
+        raise
 
-    return saved_doc
+@app.post("/recommendations/generate_all", response_description="Start recomputing recommendations for all students",
+          status_code=status.HTTP_202_ACCEPTED)
+async def generate_all_recommendations(restart: bool = Query(False, description="Start over instead of resuming an unfinished job")):
+    """Start (or resume) the cohort recommendation job in the background and return its id."""
+    if app.recommendation_job and not app.recommendation_job.done():
+        raise HTTPException(status_code=409, detail="A recommendation job is already running")
+
+    job = await open_recommendation_job(app.mongodb, restart=restart)
+    app.recommendation_job = asyncio.create_task(run_recommendation_job(app.mongodb, job))
+    return {"status": "started", "jobId": str(job["_id"]), "resumedFrom": job["lastStudentId"]}
+
+@app.get("/recommendations/jobs/{job_id}", response_description="Progress of a cohort recommendation job")
+async def get_recommendation_job(job_id: str):
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job id")
+    job = await app.mongodb["recommendation_jobs"].find_one({"_id": ObjectId(job_id)})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return MongoJSONResponse(job)
 
 @app.get("/weekly-academic-summary", response_description="Get aggregated academic data for all students")
 async def get_weekly_academic_summary():
     """Return aggregated academic data for all students for the admin dashboard."""
     try:
         students_coll = app.mongodb["Students"]
-        academics_coll = app.mongodb["academics"]
-        rec_coll = app.mongodb["recommendations"]
-        
-        # Fetch all students
-        students_cursor = students_coll.find()
-        students = []
-        async for student in students_cursor:
-            students.append(student)
-        
-        if not students:
+
+        # Join every student to their latest recommendation in a single
+        # aggregation; students without a UserID or recommendation drop out
+        pipeline = [
+            {"$match": {"UserID": {"$nin": [None, ""]}}},
+            {"$project": {"_id": 0, "UserID": 1, "Student Name": 1}},
+            {"$lookup": {
+                "from": "recommendations",
+                "localField": "UserID",
+                "foreignField": "studentId",
+                "pipeline": [
+                    {"$sort": {"generatedAt": -1}},
+                    {"$limit": 1},
+                    {"$project": {"_id": 0, "currentStudyHours": 1, "currentFocusLevel": 1, "currentMark": 1}},
+                ],
+                "as": "recommendation"
+            }},
+            {"$unwind": "$recommendation"},
+            {"$project": {
+                "studentId": "$UserID",
+                "studentName": {"$ifNull": ["$Student Name", "Unknown"]},
+                "studyHours": {"$ifNull": ["$recommendation.currentStudyHours", 0.0]},
+                "focusLevel": {"$ifNull": ["$recommendation.currentFocusLevel", 0.0]},
+                "currentMark": {"$ifNull": ["$recommendation.currentMark", 0.0]},
+            }},
+        ]
+
+        academic_data = []
+        total_study_hours = 0.0
+        total_focus_level = 0.0
+        high_focus_count = 0  # Students with focus > 7
+        high_study_count = 0  # Students studying more than 3 hrs/day
+        student_count = 0
+
+        async for row in students_coll.aggregate(pipeline):
+            academic_data.append(row)
+            total_study_hours += row["studyHours"]
+            total_focus_level += row["focusLevel"]
+            student_count += 1
+            if row["focusLevel"] > 7:
+                high_focus_count += 1
+            if row["studyHours"] > 3:
+                high_study_count += 1
+
+        if not student_count and not await students_coll.find_one({}, {"_id": 1}):
             return {
                 "totalStudents": 0,
                 "academicData": [],
@@ -1323,71 +3690,19 @@ async def get_weekly_academic_summary():
                     "dailyAverages": [0.0] * 7,
                 }
             }
-        
-        # Collect academic data for all students
-        academic_data = []
-        total_study_hours = 0.0
-        total_focus_level = 0.0
-        high_focus_count = 0  # Students with focus > 7
-        high_study_count = 0  # Students studying more than 3 hrs/day
-        student_count = 0
-        
-        # Initialize daily averages (7 days in a week)
-        daily_averages = [0.0] * 7
-        
-        for student in students:
-            student_id = student.get("UserID")
-            if not student_id:
-                continue
-                
-            # Fetch latest recommendation data for this student
-            recommendation = await rec_coll.find_one(
-                {"studentId": student_id},
-                sort=[("generatedAt", -1)]
-            )
-            
-            if recommendation:
-                study_hours = recommendation.get("currentStudyHours", 0.0)
-                focus_level = recommendation.get("currentFocusLevel", 0.0)
-                
-                academic_data.append({
-                    "studentId": student_id,
-                    "studentName": student.get("Student Name", "Unknown"),
-                    "studyHours": study_hours,
-                    "focusLevel": focus_level,
-                    "currentMark": recommendation.get("currentMark", 0.0),
-                })
-                
-                total_study_hours += study_hours
-                total_focus_level += focus_level
-                student_count += 1
-                
-                # Count students with high focus
-                if focus_level > 7:
-                    high_focus_count += 1
-                    
-                # Count students with high study hours
-                if study_hours > 3:
-                    high_study_count += 1
-                    
-                # For daily averages, we'll distribute the weekly study hours across 7 days
-                daily_average = study_hours / 7
-                for i in range(7):
-                    daily_averages[i] += daily_average
-        
+
         # Calculate averages
         avg_study_hours = total_study_hours / student_count if student_count > 0 else 0.0
         avg_focus_level = total_focus_level / student_count if student_count > 0 else 0.0
         
-        # Calculate daily averages
-        for i in range(7):
-            daily_averages[i] = daily_averages[i] / student_count if student_count > 0 else 0.0
+        # Weekly study hours are spread evenly across the 7 days of the week
+        daily_averages = [avg_study_hours / 7] * 7
         
         # Calculate high percentages
         high_focus_percentage = (high_focus_count / student_count * 100) if student_count > 0 else 0.0
         high_study_percentage = (high_study_count / student_count * 100) if student_count > 0 else 0.0
         
-        return {
+        return MongoJSONResponse({
             "totalStudents": student_count,
             "academicData": academic_data,
             "aggregateStats": {
@@ -1400,7 +3715,7 @@ async def get_weekly_academic_summary():
                 "totalStudents": student_count,
                 "dailyAverages": [round(avg, 2) for avg in daily_averages],
             }
-        }
+        })
         
     except Exception as e:
         print(f"Error fetching weekly academic summary: {str(e)}")
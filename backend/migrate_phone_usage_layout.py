@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+migrate_phone_usage_layout.py
+
+Copies PhoneUsage days from one storage layout into the other: daily
+documents (PhoneUsage) into per-student-month buckets (PhoneUsageMonthly)
+with --to monthly, or back with --to daily. Every day is upserted on
+(studentId, date), so an interrupted run can simply be repeated. The source
+collection is not modified; once the copy is done, set PHONE_USAGE_LAYOUT
+to the new layout, restart the server and drop the old collection.
+
+Run from the backend directory:
+    python migrate_phone_usage_layout.py --to monthly [--batch-size 500]
+"""
+
+import argparse
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from main import MONGO_URI, DB_NAME, PHONE_USAGE_STORES, ensure_indexes, migrate_phone_usage_layout
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Copy PhoneUsage into another storage layout")
+    p.add_argument("--to", required=True, choices=sorted(PHONE_USAGE_STORES), help="Layout to copy into")
+    p.add_argument("--batch-size", type=int, default=500, help="Days per bulk write (default: 500)")
+    return p.parse_args()
+
+
+async def main():
+    args = parse_args()
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        db = client[DB_NAME]
+        # The monthly upserts rely on the unique (studentId, month) index
+        missing = await ensure_indexes(db)
+        if missing:
+            raise SystemExit(f"❌ Missing indexes: {', '.join(missing)}")
+        copied, failed = await migrate_phone_usage_layout(db, args.to, batch_size=args.batch_size)
+        print(f"✅ Copied {copied} PhoneUsage days into the {args.to} layout")
+        if failed:
+            print(f"⚠️ {failed} days failed to write; run the migration again")
+        else:
+            print(f"Set PHONE_USAGE_LAYOUT={args.to} and restart the server to switch to it")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
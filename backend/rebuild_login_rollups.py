@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+rebuild_login_rollups.py
+
+Reconstructs the hourly login_rollups counters from the raw logins
+collection, a few days at a time. The server backfills an empty
+login_rollups collection on startup; run this whenever the counters may
+have drifted (e.g. after a failed rollup update was logged). Each counter
+is overwritten in place, and the current hour, which the server is still
+counting, is left alone, so the run does not race live logins.
+
+Run from the backend directory:
+    python rebuild_login_rollups.py [--since YYYY-MM-DD] [--days-per-batch 7]
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from main import MONGO_URI, DB_NAME, rebuild_login_rollups
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Rebuild login_rollups from logins")
+    p.add_argument("--since", type=str, default=None, help="First UTC day to rebuild, YYYY-MM-DD (default: oldest login)")
+    p.add_argument("--days-per-batch", type=int, default=7, help="Days aggregated per batch (default: 7)")
+    return p.parse_args()
+
+
+async def main():
+    args = parse_args()
+    since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        written = await rebuild_login_rollups(client[DB_NAME], since=since, days_per_batch=args.days_per_batch)
+        print(f"✅ Wrote {written} login rollup counters")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+rebuild_usage_windows.py
+
+Recomputes every student's rolling PhoneUsage window (phone_usage_windows)
+from the stored PhoneUsage days. The server keeps the windows up to date
+itself, and builds a missing one the first time it is read; the data
+generators drop the windows of the students they write. Run this after
+writing PhoneUsage outside the server some other way. Students whose window
+was stale get their usage version bumped, so their cached recommendations
+are rebuilt. Safe to re-run.
+
+Run from the backend directory:
+    python rebuild_usage_windows.py [--batch-size 200]
+"""
+
+import argparse
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from main import MONGO_URI, DB_NAME, rebuild_usage_windows
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Rebuild the rolling PhoneUsage windows")
+    p.add_argument("--batch-size", type=int, default=200, help="Students per rebuild (default: 200)")
+    return p.parse_args()
+
+
+async def main():
+    args = parse_args()
+    client = AsyncIOMotorClient(MONGO_URI)
+    try:
+        db = client[DB_NAME]
+        rebuilt = 0
+        batch = []
+        async for student in db["Students"].find({}, {"_id": 0, "UserID": 1}).sort("UserID", 1):
+            if student.get("UserID"):
+                batch.append(student["UserID"])
+            if len(batch) >= args.batch_size:
+                rebuilt += len(await rebuild_usage_windows(db, batch))
+                batch = []
+        if batch:
+            rebuilt += len(await rebuild_usage_windows(db, batch))
+        print(f"✅ Rebuilt {rebuilt} PhoneUsage windows")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -26,17 +26,23 @@ async def test_monitor_query():
         
         print("\nTesting monitor query...")
         cursor = logins_collection.find().sort("time", -1).limit(10)
+        logins = await cursor.to_list(length=10)
+
+        # Resolve all student names for the page with one query instead of one per login
+        student_names = {}
+        student_ids = list({login["username"] for login in logins if login["role"] == "student"})
+        async for student in students_collection.find({"UserID": {"$in": student_ids}}, {"UserID": 1, "Student Name": 1}):
+            if "Student Name" in student:
+                student_names[student["UserID"]] = student["Student Name"]
         last_logins = []
-        async for login in cursor:
+        for login in logins:
             username = login["username"]
             role = login["role"]
             student_name = "Unknown"
             
             # Only look up student name for student roles
             if role == "student":
-                student = await students_collection.find_one({"UserID": username})
-                if student and "Student Name" in student:
-                    student_name = student["Student Name"]
+                student_name = student_names.get(username, "Unknown")
             elif role == "admin":
                 student_name = "Admin User"
             else:
@@ -26,10 +26,18 @@ async def test_monitor_fix():
 
         # Apply the same fix as in the monitor endpoint
         cursor = logins_collection.find().sort("time", -1).limit(15)
+        logins = await cursor.to_list(length=15)
+
+        # Resolve all student names for the page with one query instead of one per login
+        student_names = {}
+        student_ids = list({login["username"] for login in logins if login["role"] == "student"})
+        async for student in students_collection.find({"UserID": {"$in": student_ids}}, {"UserID": 1, "Student Name": 1}):
+            if "Student Name" in student:
+                student_names[student["UserID"]] = student["Student Name"]
         last_logins = []
         count = 0
         
-        async for login in cursor:
+        for login in logins:
             # Adjust for timezone offset (subtract 3 hours)
             adjusted_time = login["time"] - timedelta(hours=3)
             
@@ -39,9 +47,7 @@ async def test_monitor_fix():
             
             # Only look up student name for student roles
             if role == "student":
-                student = await students_collection.find_one({"UserID": username})
-                if student and "Student Name" in student:
-                    student_name = student["Student Name"]
+                student_name = student_names.get(username, "Unknown")
             elif role == "admin":
                 student_name = "Admin User"
             else:
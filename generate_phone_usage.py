@@ -156,6 +156,12 @@ def main():
                 try:
                     res = phone_coll.insert_many(docs_to_insert)
                     total_inserted += len(res.inserted_ids)
+                    # Drop the stale rolling window (the backend rebuilds it from PhoneUsage on the
+                    # next read), then invalidate cached recommendations built from the old one
+                    db["phone_usage_windows"].delete_one({"studentId": student_identifier})
+                    db["phone_usage_versions"].update_one(
+                        {"studentId": student_identifier}, {"$inc": {"version": 1}}, upsert=True
+                    )
                     print(f"Inserted {len(res.inserted_ids)} docs for student '{student_identifier}'")
                 except errors.BulkWriteError as bwe:
                     print("Bulk write error:", bwe.details)
@@ -166,6 +172,9 @@ def main():
     print("Total inserted:", total_inserted)
     print("Total skipped (existing, skip mode):", total_skipped)
     print("Total overwritten (when mode=overwrite):", total_overwritten)
+    if total_inserted and not args.dry_run:
+        print("Per-category minutes are filled in by the backend on startup, or now with: python backend/backfill_app_categories.py")
+        print("With PHONE_USAGE_LAYOUT=monthly, copy them into buckets with: python backend/migrate_phone_usage_layout.py --to monthly")
     print("Done.")
 
 if __name__ == "__main__":
@@ -93,21 +93,31 @@ class _ForgotPasswordPageState extends State<ForgotPasswordPage> {
     try {
       print('Trying fallback - checking students database'); // Debug log
       print('Using API URL: $apiBaseUrl/students'); // Debug log to verify URL
-      final response = await http.get(
-        Uri.parse('$apiBaseUrl/students'),
-        headers: {'Content-Type': 'application/json'},
-      ).timeout(Duration(seconds: 30)); // Add timeout
+      // /students is paged; follow X-Next-Cursor until the email turns up or the pages run out
+      final email = _emailController.text.trim().toLowerCase();
+      bool emailExists = false;
+      String? cursor;
+      http.Response response;
+      do {
+        response = await http.get(
+          Uri.parse('$apiBaseUrl/students').replace(
+            queryParameters: cursor != null ? {'cursor': cursor} : null,
+          ),
+          headers: {'Content-Type': 'application/json'},
+        ).timeout(Duration(seconds: 30)); // Add timeout
+
+        print('Students API status: ${response.statusCode}'); // Debug log
+        if (response.statusCode != 200) break;
 
-      print('Students API status: ${response.statusCode}'); // Debug log
-      
-      if (response.statusCode == 200) {
         final List<dynamic> students = jsonDecode(response.body);
-        
-        // Check if email exists in students list
-        bool emailExists = students.any((student) => 
-          student['Email']?.toString().toLowerCase() == _emailController.text.trim().toLowerCase()
+        // Check if email exists in this page of students
+        emailExists = students.any((student) =>
+          student['Email']?.toString().toLowerCase() == email
         );
+        cursor = response.headers['x-next-cursor'];
+      } while (!emailExists && cursor != null && cursor.isNotEmpty);
 
+      if (response.statusCode == 200) {
         if (emailExists) {
           setState(() {
             _isEmailVerified = true;
@@ -15,6 +15,10 @@ class ViewStud extends StatefulWidget {
 
 class _ViewStudState extends State<ViewStud> {
   late Future<List<dynamic>> _studentsFuture;
+  // Students loaded so far; further pages are fetched on demand with "Load more"
+  final List<dynamic> _students = [];
+  String? _nextCursor;
+  bool _loadingMore = false;
 
   @override
   void initState() {
@@ -22,20 +26,40 @@ class _ViewStudState extends State<ViewStud> {
     _studentsFuture = fetchStudents();
   }
 
-  Future<List<dynamic>> fetchStudents() async {
-    final url = Uri.parse('$apiBaseUrl/students');
+  Future<List<dynamic>> fetchStudents({String? cursor}) async {
     try {
+      // The backend returns students in pages; X-Next-Cursor points at the next one
+      final url = Uri.parse('$apiBaseUrl/students').replace(
+        queryParameters: cursor != null ? {'cursor': cursor} : null,
+      );
       final response = await http.get(url, headers: {'Content-Type': 'application/json'});
-      if (response.statusCode == 200) {
-        return jsonDecode(response.body);
-      } else {
+      if (response.statusCode != 200) {
         throw Exception('Failed to load students. Status code: ${response.statusCode}');
       }
+      final page = jsonDecode(response.body);
+      final next = response.headers['x-next-cursor'];
+      _students.addAll(page);
+      _nextCursor = next != null && next.isNotEmpty ? next : null;
+      return _students;
     } catch (e) {
       throw Exception('Failed to load students: $e');
     }
   }
 
+  Future<void> _loadMore() async {
+    if (_loadingMore || _nextCursor == null) return;
+    setState(() => _loadingMore = true);
+    try {
+      await fetchStudents(cursor: _nextCursor);
+    } catch (e) {
+      if (mounted) {
+        ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text('$e')));
+      }
+    } finally {
+      if (mounted) setState(() => _loadingMore = false);
+    }
+  }
+
   @override
   Widget build(BuildContext context) {
     return Scaffold(
@@ -190,110 +214,128 @@ class _ViewStudState extends State<ViewStud> {
                         padding: const EdgeInsets.all(16),
                         child: SingleChildScrollView(
                           scrollDirection: Axis.vertical,
-                          child: SingleChildScrollView(
-                            scrollDirection: Axis.horizontal,
-                            child: Theme(
-                              data: Theme.of(context).copyWith(
-                                dataTableTheme: DataTableThemeData(
-                                  headingRowColor: MaterialStateProperty.all(
-                                    AppTheme.primaryColor.withOpacity(0.1),
-                                  ),
-                                  dataRowColor: MaterialStateProperty.resolveWith(
-                                    (states) {
-                                      if (states.contains(MaterialState.selected)) {
-                                        return AppTheme.cardBackground.withOpacity(0.3);
-                                      }
-                                      return null;
-                                    },
-                                  ),
-                                  headingTextStyle: Theme.of(context).textTheme.titleMedium?.copyWith(
-                                    fontWeight: FontWeight.bold,
-                                    color: AppTheme.primaryColor,
-                                  ),
-                                  dataTextStyle: Theme.of(context).textTheme.bodyMedium?.copyWith(
-                                    color: AppTheme.textPrimary,
+                          child: Column(
+                            crossAxisAlignment: CrossAxisAlignment.start,
+                            children: [
+                              SingleChildScrollView(
+                                scrollDirection: Axis.horizontal,
+                                child: Theme(
+                                  data: Theme.of(context).copyWith(
+                                    dataTableTheme: DataTableThemeData(
+                                      headingRowColor: MaterialStateProperty.all(
+                                        AppTheme.primaryColor.withOpacity(0.1),
+                                      ),
+                                      dataRowColor: MaterialStateProperty.resolveWith(
+                                        (states) {
+                                          if (states.contains(MaterialState.selected)) {
+                                            return AppTheme.cardBackground.withOpacity(0.3);
+                                          }
+                                          return null;
+                                        },
+                                      ),
+                                      headingTextStyle: Theme.of(context).textTheme.titleMedium?.copyWith(
+                                        fontWeight: FontWeight.bold,
+                                        color: AppTheme.primaryColor,
+                                      ),
+                                      dataTextStyle: Theme.of(context).textTheme.bodyMedium?.copyWith(
+                                        color: AppTheme.textPrimary,
+                                      ),
+                                    ),
                                   ),
-                                ),
-                              ),
-                              child: DataTable(
-                                columnSpacing: 20,
-                                horizontalMargin: 16,
-                                border: TableBorder.all(
-                                  color: AppTheme.primaryColor.withOpacity(0.2),
-                                  width: 1,
-                                  borderRadius: BorderRadius.circular(8),
-                                ),
-                                columns: const [
-                                  DataColumn(label: Text("Student Name")),
-                                  DataColumn(label: Text("Admission No")),
-                                  DataColumn(label: Text("Department")),
-                                  DataColumn(label: Text("Academic Year")),
-                                  DataColumn(label: Text("Semester")),
-                                  DataColumn(label: Text("Phone")),
-                                  DataColumn(label: Text("Email")),
-                                  DataColumn(label: Text("Gender")),
-                                  DataColumn(label: Text("DOB")),
-                                  DataColumn(label: Text("Father Name")),
-                                  DataColumn(label: Text("Mother Name")),
-                                  DataColumn(label: Text("Address")),
-                                  DataColumn(label: Text("Parent Phone")),
-                                  DataColumn(label: Text("Guardian Name")),
-                                  DataColumn(label: Text("Guardian Phone")),
-                                  DataColumn(label: Text("UserID")),
-                                ],
-                                rows: students.asMap().entries.map((entry) {
-                                  final index = entry.key;
-                                  final student = entry.value;
+                                  child: DataTable(
+                                    columnSpacing: 20,
+                                    horizontalMargin: 16,
+                                    border: TableBorder.all(
+                                      color: AppTheme.primaryColor.withOpacity(0.2),
+                                      width: 1,
+                                      borderRadius: BorderRadius.circular(8),
+                                    ),
+                                    columns: const [
+                                      DataColumn(label: Text("Student Name")),
+                                      DataColumn(label: Text("Admission No")),
+                                      DataColumn(label: Text("Department")),
+                                      DataColumn(label: Text("Academic Year")),
+                                      DataColumn(label: Text("Semester")),
+                                      DataColumn(label: Text("Phone")),
+                                      DataColumn(label: Text("Email")),
+                                      DataColumn(label: Text("Gender")),
+                                      DataColumn(label: Text("DOB")),
+                                      DataColumn(label: Text("Father Name")),
+                                      DataColumn(label: Text("Mother Name")),
+                                      DataColumn(label: Text("Address")),
+                                      DataColumn(label: Text("Parent Phone")),
+                                      DataColumn(label: Text("Guardian Name")),
+                                      DataColumn(label: Text("Guardian Phone")),
+                                      DataColumn(label: Text("UserID")),
+                                    ],
+                                    rows: students.asMap().entries.map((entry) {
+                                      final index = entry.key;
+                                      final student = entry.value;
                                   
-                                  // Add a visual indicator for recently added students (first 3)
-                                  final isRecentlyAdded = index < 3;
+                                      // Add a visual indicator for recently added students (first 3)
+                                      final isRecentlyAdded = index < 3;
                                   
-                                  return DataRow(
-                                    color: MaterialStateProperty.all(
-                                      isRecentlyAdded
-                                        ? AppTheme.primaryColor.withOpacity(0.1) // Highlight recent entries
-                                        : index.isEven 
-                                          ? AppTheme.cardBackground.withOpacity(0.1)
-                                          : Colors.transparent,
-                                    ),
-                                    cells: [
-                                      DataCell(
-                                        Row(
-                                          children: [
-                                            if (isRecentlyAdded) ...[
-                                              Icon(
-                                                Icons.fiber_new,
-                                                color: AppTheme.primaryColor,
-                                                size: 16,
-                                              ),
-                                              const SizedBox(width: 4),
-                                            ],
-                                            Expanded(
-                                              child: Text(student["Student Name"]?.toString() ?? ""),
-                                            ),
-                                          ],
+                                      return DataRow(
+                                        color: MaterialStateProperty.all(
+                                          isRecentlyAdded
+                                            ? AppTheme.primaryColor.withOpacity(0.1) // Highlight recent entries
+                                            : index.isEven 
+                                              ? AppTheme.cardBackground.withOpacity(0.1)
+                                              : Colors.transparent,
                                         ),
-                                      ),
-                                      DataCell(Text(student["Admission No"]?.toString() ?? "")),
-                                      DataCell(Text(student["Department"]?.toString() ?? "")),
-                                      DataCell(Text(student["Academic Year"]?.toString() ?? "")),
-                                      DataCell(Text(student["Semester"]?.toString() ?? "")),
-                                      DataCell(Text(student["Phone"]?.toString() ?? "")),
-                                      DataCell(Text(student["Email"]?.toString() ?? "")),
-                                      DataCell(Text(student["Gender"]?.toString() ?? "")),
-                                      DataCell(Text(student["dob"]?.toString() ?? "")),
-                                      DataCell(Text(student["Father Name"]?.toString() ?? "")),
-                                      DataCell(Text(student["Mother Name"]?.toString() ?? "")),
-                                      DataCell(Text(student["Address"]?.toString() ?? "")),
-                                      DataCell(Text(student["Parent Phone"]?.toString() ?? "")),
-                                      DataCell(Text(student["Guardian Name"]?.toString() ?? "")),
-                                      DataCell(Text(student["Guardian Phone"]?.toString() ?? "")),
-                                      DataCell(Text(student["UserID"]?.toString() ?? "")),
-                                    ],
-                                  );
-                                }).toList(),
+                                        cells: [
+                                          DataCell(
+                                            Row(
+                                              children: [
+                                                if (isRecentlyAdded) ...[
+                                                  Icon(
+                                                    Icons.fiber_new,
+                                                    color: AppTheme.primaryColor,
+                                                    size: 16,
+                                                  ),
+                                                  const SizedBox(width: 4),
+                                                ],
+                                                Expanded(
+                                                  child: Text(student["Student Name"]?.toString() ?? ""),
+                                                ),
+                                              ],
+                                            ),
+                                          ),
+                                          DataCell(Text(student["Admission No"]?.toString() ?? "")),
+                                          DataCell(Text(student["Department"]?.toString() ?? "")),
+                                          DataCell(Text(student["Academic Year"]?.toString() ?? "")),
+                                          DataCell(Text(student["Semester"]?.toString() ?? "")),
+                                          DataCell(Text(student["Phone"]?.toString() ?? "")),
+                                          DataCell(Text(student["Email"]?.toString() ?? "")),
+                                          DataCell(Text(student["Gender"]?.toString() ?? "")),
+                                          DataCell(Text(student["dob"]?.toString() ?? "")),
+                                          DataCell(Text(student["Father Name"]?.toString() ?? "")),
+                                          DataCell(Text(student["Mother Name"]?.toString() ?? "")),
+                                          DataCell(Text(student["Address"]?.toString() ?? "")),
+                                          DataCell(Text(student["Parent Phone"]?.toString() ?? "")),
+                                          DataCell(Text(student["Guardian Name"]?.toString() ?? "")),
+                                          DataCell(Text(student["Guardian Phone"]?.toString() ?? "")),
+                                          DataCell(Text(student["UserID"]?.toString() ?? "")),
+                                        ],
+                                      );
+                                    }).toList(),
+                                  ),
+                                ),
                               ),
-                            ),
+                              if (_nextCursor != null)
+                                Padding(
+                                  padding: const EdgeInsets.only(top: 16),
+                                  child: Center(
+                                    child: _loadingMore
+                                        ? const CircularProgressIndicator()
+                                        : TextButton.icon(
+                                            onPressed: _loadMore,
+                                            icon: const Icon(Icons.expand_more),
+                                            label: const Text("Load more"),
+                                          ),
+                                  ),
+                                ),
+                            ],
                           ),
                         ),
                       );
@@ -76,6 +76,10 @@ async def main():
         }
     ]
     await db["PhoneUsage"].insert_many(phone_usage)
+    for student_id in {doc["studentId"] for doc in phone_usage}:
+        # The backend rebuilds a missing rolling window from PhoneUsage on the next read
+        await db["phone_usage_windows"].delete_one({"studentId": student_id})
+        await db["phone_usage_versions"].update_one({"studentId": student_id}, {"$inc": {"version": 1}}, upsert=True)
 
     print("✅ Test data inserted successfully")
     client.close()